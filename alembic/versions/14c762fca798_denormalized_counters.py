@@ -0,0 +1,91 @@
+"""denormalized counters
+
+Revision ID: 14c762fca798
+Revises: 5e8800057604
+Create Date: 2026-10-18 13:40:02.117935
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '14c762fca798'
+down_revision: Union[str, Sequence[str], None] = '5e8800057604'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("news", sa.Column("comments_count", sa.Integer(), nullable=False, server_default=sa.text("0")))
+    op.add_column("users", sa.Column("news_count", sa.Integer(), nullable=False, server_default=sa.text("0")))
+    op.add_column("users", sa.Column("comments_count", sa.Integer(), nullable=False, server_default=sa.text("0")))
+
+    # Начальные значения счётчиков
+    op.execute("""
+        UPDATE news n SET comments_count = c.cnt
+        FROM (SELECT news_id, count(*) AS cnt FROM comments GROUP BY news_id) c
+        WHERE c.news_id = n.id
+    """)
+    op.execute("""
+        UPDATE users u SET news_count = n.cnt
+        FROM (SELECT author_id, count(*) AS cnt FROM news GROUP BY author_id) n
+        WHERE n.author_id = u.id
+    """)
+    op.execute("""
+        UPDATE users u SET comments_count = c.cnt
+        FROM (SELECT author_id, count(*) AS cnt FROM comments GROUP BY author_id) c
+        WHERE c.author_id = u.id
+    """)
+
+    # Дальше счётчики ведут триггеры - так они верны и для API, и для COPY-загрузки, и для каскадных удалений
+    op.execute("""
+        CREATE FUNCTION comments_counters() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                UPDATE news SET comments_count = comments_count - 1 WHERE id = OLD.news_id;
+                UPDATE users SET comments_count = comments_count - 1 WHERE id = OLD.author_id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE news SET comments_count = comments_count + 1 WHERE id = NEW.news_id;
+                UPDATE users SET comments_count = comments_count + 1 WHERE id = NEW.author_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER comments_counters
+        AFTER INSERT OR DELETE OR UPDATE OF news_id, author_id ON comments
+        FOR EACH ROW EXECUTE FUNCTION comments_counters()
+    """)
+    op.execute("""
+        CREATE FUNCTION news_counters() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                UPDATE users SET news_count = news_count - 1 WHERE id = OLD.author_id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE users SET news_count = news_count + 1 WHERE id = NEW.author_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER news_counters
+        AFTER INSERT OR DELETE OR UPDATE OF author_id ON news
+        FOR EACH ROW EXECUTE FUNCTION news_counters()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER news_counters ON news")
+    op.execute("DROP FUNCTION news_counters()")
+    op.execute("DROP TRIGGER comments_counters ON comments")
+    op.execute("DROP FUNCTION comments_counters()")
+    op.drop_column("users", "comments_count")
+    op.drop_column("users", "news_count")
+    op.drop_column("news", "comments_count")
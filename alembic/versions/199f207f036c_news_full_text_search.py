@@ -0,0 +1,47 @@
+"""news full text search
+
+Revision ID: 199f207f036c
+Revises: 14c762fca798
+Create Date: 2026-10-18 15:05:44.390157
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '199f207f036c'
+down_revision: Union[str, Sequence[str], None] = '14c762fca798'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Должно совпадать с выражением News.search_vector в app/models/news.py
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+    "setweight(jsonb_to_tsvector('russian', content, '[\"string\"]'), 'B')"
+)
+
+
+def upgrade() -> None:
+    # STORED-колонка вычисляется при записи; добавление переписывает таблицу
+    op.add_column(
+        "news",
+        sa.Column("search_vector", postgresql.TSVECTOR(), sa.Computed(SEARCH_VECTOR, persisted=True)),
+    )
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_news_search_vector",
+            "news",
+            ["search_vector"],
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_news_search_vector", table_name="news", postgresql_concurrently=True)
+    op.drop_column("news", "search_vector")
@@ -0,0 +1,54 @@
+"""updated_at
+
+Revision ID: 3d5c0b6a91e2
+Revises: 199f207f036c
+Create Date: 2026-10-18 15:42:10.204311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d5c0b6a91e2'
+down_revision: Union[str, Sequence[str], None] = '199f207f036c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("news", "users", "comments")
+
+
+def upgrade() -> None:
+    # now() не volatile: колонка добавляется без перезаписи таблицы,
+    # у существующих строк updated_at равен времени миграции
+    for table in TABLES:
+        op.add_column(
+            table,
+            sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.text("(now() at time zone 'utc')")),
+        )
+
+    # updated_at ведёт триггер - так оно верно и для API, и для COPY-загрузки, и для изменений счётчиков
+    op.execute("""
+        CREATE FUNCTION touch_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at := now() at time zone 'utc';
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    for table in TABLES:
+        op.execute(f"""
+            CREATE TRIGGER {table}_touch_updated_at
+            BEFORE UPDATE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION touch_updated_at()
+        """)
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.execute(f"DROP TRIGGER {table}_touch_updated_at ON {table}")
+    op.execute("DROP FUNCTION touch_updated_at()")
+    for table in TABLES:
+        op.drop_column(table, "updated_at")
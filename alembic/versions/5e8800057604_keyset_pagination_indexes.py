@@ -0,0 +1,41 @@
+"""keyset pagination indexes
+
+Revision ID: 5e8800057604
+Revises: 78b8a6bbf783
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8800057604'
+down_revision: Union[str, Sequence[str], None] = '78b8a6bbf783'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY не блокирует запись в большие таблицы, но не работает внутри транзакции
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_news_published_at_id",
+            "news",
+            [sa.text("published_at DESC"), sa.text("id DESC")],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_comments_news_id_published_at_id",
+            "comments",
+            ["news_id", "published_at", "id"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_comments_news_id_published_at_id", table_name="comments", postgresql_concurrently=True)
+        op.drop_index("ix_news_published_at_id", table_name="news", postgresql_concurrently=True)
@@ -0,0 +1,126 @@
+"""partition comments by published_at
+
+Revision ID: 8a41f2c7d9b3
+Revises: 3d5c0b6a91e2
+Create Date: 2026-10-18 17:12:31.508214
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a41f2c7d9b3'
+down_revision: Union[str, Sequence[str], None] = '3d5c0b6a91e2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Сколько месяцев вперёд создаются секции; дальше их заводит python -m app.db.partitions maintain
+MONTHS_AHEAD = 3
+
+COLUMNS = "id, text, published_at, updated_at, news_id, author_id"
+
+
+def _add_months(month: datetime, n: int) -> datetime:
+    years, month_index = divmod(month.month - 1 + n, 12)
+    return datetime(month.year + years, month_index + 1, 1)
+
+
+def _comment_columns():
+    return [
+        sa.Column("id", sa.Integer(), server_default=sa.text("nextval('comments_id_seq')"), nullable=False),
+        sa.Column("text", sa.Text(), nullable=False),
+        sa.Column("published_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.text("(now() at time zone 'utc')")),
+        sa.Column("news_id", sa.Integer(), nullable=False),
+        sa.Column("author_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["author_id"], ["users.id"], name="fk_comments_author_id_users", ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["news_id"], ["news.id"], name="fk_comments_news_id_news", ondelete="CASCADE"),
+    ]
+
+
+def _create_triggers():
+    # Строковые триггеры на секционированной таблице клонируются во все секции (BEFORE - с PostgreSQL 13)
+    op.execute("""
+        CREATE TRIGGER comments_counters
+        AFTER INSERT OR DELETE OR UPDATE OF news_id, author_id ON comments
+        FOR EACH ROW EXECUTE FUNCTION comments_counters()
+    """)
+    op.execute("""
+        CREATE TRIGGER comments_touch_updated_at
+        BEFORE UPDATE ON comments
+        FOR EACH ROW EXECUTE FUNCTION touch_updated_at()
+    """)
+
+
+def _swap_out(old_name: str, indexes: Sequence[str]):
+    # Старая таблица уходит в сторону вместе с именами, которые нужны новой
+    op.execute(f"ALTER TABLE comments RENAME TO {old_name}")
+    op.execute(f"ALTER TABLE {old_name} RENAME CONSTRAINT pk_comments TO pk_{old_name}")
+    for index in indexes:
+        op.drop_index(index, table_name=old_name)
+
+
+def _swap_in(old_name: str):
+    # Строки копируются до создания триггеров - счётчики уже верны, повторно их не увеличиваем
+    op.execute(f"INSERT INTO comments ({COLUMNS}) SELECT {COLUMNS} FROM {old_name}")
+    op.execute("ALTER SEQUENCE comments_id_seq OWNED BY comments.id")
+    op.drop_table(old_name)
+    _create_triggers()
+
+
+def upgrade() -> None:
+    # Таблицу нельзя секционировать на месте: создаётся новая, строки копируются в той же транзакции.
+    # Запись в comments на время миграции блокируется - на больших объёмах запускать в окно обслуживания.
+    _swap_out(
+        "comments_unpartitioned",
+        ("ix_comments_news_id_published_at_id", "ix_comments_news_id", "ix_comments_author_id"),
+    )
+    # Первичный ключ секционированной таблицы обязан включать ключ секционирования;
+    # уникальность id по-прежнему даёт последовательность
+    op.create_table(
+        "comments",
+        *_comment_columns(),
+        sa.PrimaryKeyConstraint("id", "published_at", name="pk_comments"),
+        postgresql_partition_by="RANGE (published_at)",
+    )
+
+    # Помесячные секции от самого старого комментария до MONTHS_AHEAD месяцев вперёд
+    # и секция по умолчанию для строк вне диапазонов (загрузка задним числом, сбой maintain)
+    first = op.get_bind().scalar(sa.text("SELECT min(published_at) FROM comments_unpartitioned"))
+    now = datetime.utcnow()
+    month = datetime((first or now).year, (first or now).month, 1)
+    last = _add_months(datetime(now.year, now.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        upper = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE comments_p{month:%Y_%m} PARTITION OF comments "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+        )
+        month = upper
+    op.execute("CREATE TABLE comments_default PARTITION OF comments DEFAULT")
+
+    _swap_in("comments_unpartitioned")
+    # Индексы на секционированной таблице создаются в каждой секции. Отдельный индекс по news_id
+    # не нужен: его покрывает (news_id, published_at, id)
+    op.create_index("ix_comments_news_id_published_at_id", "comments", ["news_id", "published_at", "id"])
+    op.create_index("ix_comments_author_id", "comments", ["author_id"])
+    # autovacuum не собирает статистику по родительской таблице
+    op.execute("ANALYZE comments")
+
+
+def downgrade() -> None:
+    # Отсоединённые архивные секции (схема archive) не возвращаются
+    _swap_out("comments_partitioned", ("ix_comments_news_id_published_at_id", "ix_comments_author_id"))
+    op.create_table(
+        "comments",
+        *_comment_columns(),
+        sa.PrimaryKeyConstraint("id", name="pk_comments"),
+    )
+    _swap_in("comments_partitioned")
+    op.create_index("ix_comments_news_id_published_at_id", "comments", ["news_id", "published_at", "id"])
+    op.create_index("ix_comments_news_id", "comments", ["news_id"])
+    op.create_index("ix_comments_author_id", "comments", ["author_id"])
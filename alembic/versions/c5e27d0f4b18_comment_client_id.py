@@ -0,0 +1,33 @@
+"""comment client_id
+
+Revision ID: c5e27d0f4b18
+Revises: 8a41f2c7d9b3
+Create Date: 2026-10-18 18:03:47.661920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5e27d0f4b18'
+down_revision: Union[str, Sequence[str], None] = '8a41f2c7d9b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Колонка без значения по умолчанию добавляется без перезаписи секций
+    op.add_column("comments", sa.Column("client_id", sa.Uuid(), nullable=True))
+    # Уникальный индекс секционированной таблицы обязан включать ключ секционирования;
+    # NULL у комментариев, созданных напрямую, не конфликтуют между собой
+    op.create_index(
+        "uq_comments_client_id_published_at", "comments", ["client_id", "published_at"], unique=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("uq_comments_client_id_published_at", table_name="comments")
+    op.drop_column("comments", "client_id")
@@ -0,0 +1,23 @@
+import os
+import time
+import jwt
+
+JWT_ALGORITHM = "HS256"
+
+def make_access_payload(user_id: int, is_admin: bool, is_verified_author: bool) -> dict:
+    # Флаги прав кладутся в токен, чтобы проверки доступа не ходили в БД
+    now = int(time.time())
+    return {
+        "sub": str(user_id),
+        "adm": bool(is_admin),
+        "ver": bool(is_verified_author),
+        "type": "access",
+        "iat": now,
+        "exp": now + int(os.getenv("JWT_EXPIRES_MIN", "15")) * 60,
+    }
+
+def jwt_encode(payload: dict, secret: str) -> str:
+    return jwt.encode(payload, secret, algorithm=JWT_ALGORITHM)
+
+def jwt_decode(token: str, secret: str) -> dict:
+    return jwt.decode(token, secret, algorithms=[JWT_ALGORITHM], options={"require": ["sub", "exp"]})
@@ -0,0 +1,54 @@
+"""Перенос refresh-сессий из старого формата session:{user_id}:{token} в refresh:{sha256(token)}.
+
+Запуск: python -m app.auth.migrate_sessions
+Использует SCAN, поэтому не блокирует Redis; повторный запуск безопасен.
+"""
+import asyncio
+import json
+from app.db.db import redis_client
+from app.auth.sessions import SESSION_TTL_DAYS, save_session, token_hash
+
+BATCH = 500
+
+async def migrate() -> int:
+    moved = 0
+    batch = []
+    async for key in redis_client.scan_iter(match="session:*:*", count=BATCH):
+        batch.append(key)
+        if len(batch) >= BATCH:
+            moved += await _migrate_batch(batch)
+            batch = []
+    if batch:
+        moved += await _migrate_batch(batch)
+    return moved
+
+async def _migrate_batch(keys: list[str]) -> int:
+    pipe = redis_client.pipeline()
+    for key in keys:
+        pipe.get(key)
+        pipe.ttl(key)
+    values = await pipe.execute()
+
+    moved = 0
+    for key, raw, ttl in zip(keys, values[::2], values[1::2]):
+        _, user_id, raw_token = key.split(":", 2)
+        if raw is None or ttl == -2:
+            continue
+        try:
+            data = json.loads(raw)
+            # user_id есть в самом старом ключе, даже если в данных сессии его нет
+            data.setdefault("user_id", int(user_id))
+        except (json.JSONDecodeError, AttributeError, ValueError):
+            continue
+        if ttl == -1:
+            # у старых сессий без срока в Redis - обычный срок жизни новой сессии, иначе пользователь
+            # оказался бы разлогинен
+            ttl = SESSION_TTL_DAYS * 86400
+        if ttl > 0:
+            await save_session(token_hash(raw_token), data, ttl)
+            moved += 1
+        await redis_client.delete(key)
+    return moved
+
+if __name__ == "__main__":
+    print(f"migrated {asyncio.run(migrate())} sessions")
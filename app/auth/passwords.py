@@ -0,0 +1,69 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from fastapi import HTTPException
+from app.metrics import PASSWORD_HASH_LATENCY, PASSWORD_HASH_REJECTED
+
+# Параметры Argon2; при их изменении хэши пересчитываются при следующем входе пользователя
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+
+# Хэширование идёт в отдельном пуле потоков (argon2-cffi отпускает GIL), чтобы всплеск входов
+# не занимал общий threadpool и event loop. Если в очереди больше PASSWORD_HASH_QUEUE задач, отвечаем 503.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "2"))
+
+@cache
+def password_hasher() -> PasswordHasher:
+    # создаётся при первом хэшировании, а не при импорте
+    return PasswordHasher(
+        time_cost=ARGON2_TIME_COST,
+        memory_cost=ARGON2_MEMORY_COST,
+        parallelism=ARGON2_PARALLELISM,
+    )
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="argon2")
+_pending = 0
+
+def hash_password(password: str) -> str:
+    with PASSWORD_HASH_LATENCY.labels("hash").time():
+        return password_hasher().hash(password)
+
+def verify_password(password: str, password_hash: str) -> bool:
+    try:
+        with PASSWORD_HASH_LATENCY.labels("verify").time():
+            return password_hasher().verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+def needs_rehash(password_hash: str) -> bool:
+    try:
+        return password_hasher().check_needs_rehash(password_hash)
+    except InvalidHashError:
+        return True
+
+async def _run_limited(fn, *args):
+    global _pending
+    if _pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE:
+        PASSWORD_HASH_REJECTED.inc()
+        raise HTTPException(
+            503,
+            "Too many authentication requests, try again later",
+            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)},
+        )
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        _pending -= 1
+
+async def hash_password_async(password: str) -> str:
+    return await _run_limited(hash_password, password)
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+    return await _run_limited(verify_password, password, password_hash)
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import time
+from app.db.db import redis_client
+
+# Хранилище refresh-сессий в Redis:
+#   refresh:{sha256(token)}  -> json с данными сессии (TTL = срок жизни сессии)
+#   user_sessions:{user_id}  -> множество хэшей токенов пользователя
+# Поиск по токену - один GET, список сессий пользователя - SMEMBERS + MGET, без KEYS по всему keyspace.
+
+SESSION_TTL_DAYS = 30
+
+def token_hash(raw_token: str) -> str:
+    return hashlib.sha256(raw_token.encode()).hexdigest()
+
+def session_key(token_hash: str) -> str:
+    return f"refresh:{token_hash}"
+
+def user_sessions_key(user_id: int) -> str:
+    return f"user_sessions:{user_id}"
+
+async def save_session(h: str, data: dict, ttl: int):
+    index_key = user_sessions_key(data["user_id"])
+    pipe = redis_client.pipeline()
+    pipe.set(session_key(h), json.dumps(data), ex=ttl)
+    pipe.sadd(index_key, h)
+    # индекс переживает любую сессию пользователя; хэши истёкших сессий вычищает list_sessions
+    pipe.expire(index_key, SESSION_TTL_DAYS * 86400)
+    await pipe.execute()
+
+async def create_session(user_id: int, user_agent: str | None) -> str:
+    raw_refresh = os.urandom(32).hex()
+    ttl = SESSION_TTL_DAYS * 86400
+    now = int(time.time())
+    await save_session(token_hash(raw_refresh), {
+        "user_id": user_id,
+        "user_agent": user_agent or "",
+        "created_at": now,
+        "expires_at": now + ttl,
+    }, ttl)
+    return raw_refresh
+
+async def get_session(raw_token: str) -> dict | None:
+    raw = await redis_client.get(session_key(token_hash(raw_token)))
+    if raw is None:
+        return None
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        return None
+
+async def delete_session(raw_token: str):
+    h = token_hash(raw_token)
+    data = await get_session(raw_token)
+    pipe = redis_client.pipeline()
+    pipe.delete(session_key(h))
+    if data:
+        pipe.srem(user_sessions_key(data["user_id"]), h)
+    await pipe.execute()
+
+async def list_sessions(user_id: int) -> list[dict]:
+    index_key = user_sessions_key(user_id)
+    hashes = list(await redis_client.smembers(index_key))
+    if not hashes:
+        return []
+    sessions, expired = [], []
+    for h, raw in zip(hashes, await redis_client.mget([session_key(h) for h in hashes])):
+        if raw is None:
+            expired.append(h)
+            continue
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError:
+            continue
+        sessions.append({
+            "id": h,
+            "user_agent": data.get("user_agent"),
+            "created_at": data.get("created_at"),
+            "expires_at": data.get("expires_at"),
+        })
+    # чистим из индекса хэши сессий, ключи которых уже истекли
+    if expired:
+        await redis_client.srem(index_key, *expired)
+    return sessions
@@ -1,29 +0,0 @@
-from datetime import datetime
-from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, Integer, DateTime, Boolean
-
-from app.models import Base
-
-
-class User(Base):
-    __tablename__ = "users"
-
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    name: Mapped[str] = mapped_column(String(100), nullable=False)
-    email: Mapped[str] = mapped_column(String(255), nullable=False, unique=True, index=True)
-    registered_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
-    password_hash: Mapped[str | None] = mapped_column(String(512), nullable=True)
-    is_admin: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
-    is_verified_author: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
-    avatar_url: Mapped[str | None] = mapped_column(String(512), nullable=True)
-
-    news: Mapped[list["News"]] = relationship(
-        back_populates="author",
-        cascade="all, delete-orphan",
-        passive_deletes=True
-    )
-    comments: Mapped[list["Comment"]] = relationship(
-        back_populates="author",
-        cascade="all, delete-orphan",
-        passive_deletes=True
-    )
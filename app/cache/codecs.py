@@ -0,0 +1,149 @@
+import json
+import os
+import struct
+from typing import Any, NamedTuple
+
+# Необязательные зависимости: без orjson используется стандартный json,
+# msgpack/zstandard/brotli нужны только если выбраны в настройках
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CACHE_CODEC = os.getenv("CACHE_CODEC", "json")
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "none")
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "2048"))
+
+class JsonCodec:
+    id = 1
+    is_json = True
+
+    def dumps(self, value: Any) -> bytes:
+        if orjson:
+            return orjson.dumps(value, default=str)
+        return json.dumps(value, ensure_ascii=False, default=str, separators=(",", ":")).encode()
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data) if orjson else json.loads(data)
+
+class MsgpackCodec:
+    id = 2
+    is_json = False
+
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=str, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+class NoCompression:
+    id = 0
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+class ZstdCompression:
+    id = 1
+
+    def compress(self, data: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+class BrotliCompression:
+    id = 2
+
+    def compress(self, data: bytes) -> bytes:
+        return brotli.compress(data, quality=4)
+
+    def decompress(self, data: bytes) -> bytes:
+        return brotli.decompress(data)
+
+JSON = JsonCodec()
+CODECS = {"json": (JSON, True), "msgpack": (MsgpackCodec(), msgpack is not None)}
+COMPRESSIONS = {
+    "none": (NoCompression(), True),
+    "zstd": (ZstdCompression(), zstandard is not None),
+    "brotli": (BrotliCompression(), brotli is not None),
+}
+
+def _pick(options: dict, name: str, setting: str):
+    if name not in options:
+        raise RuntimeError(f"{setting}={name!r} is not supported, expected one of {sorted(options)}")
+    impl, available = options[name]
+    if not available:
+        raise RuntimeError(f"{setting}={name!r} requires an optional dependency that is not installed")
+    return impl
+
+codec = _pick(CODECS, CACHE_CODEC, "CACHE_CODEC")
+compression = _pick(COMPRESSIONS, CACHE_COMPRESSION, "CACHE_COMPRESSION")
+_codecs_by_id = {impl.id: impl for impl, available in CODECS.values() if available}
+_compressions_by_id = {impl.id: impl for impl, available in COMPRESSIONS.values() if available}
+
+# Формат значения в Redis: MAGIC, заголовок (кодек, сжатие, флаги, логическое истечение, время расчёта),
+# при флаге FLAG_MODIFIED - время последнего изменения (для Last-Modified без разбора тела), тело.
+# 0xC1 не встречается ни в UTF-8, ни в msgpack, поэтому значения старого формата (голый json) отличимы.
+MAGIC = b"\xc1"
+HEADER = struct.Struct("!BBBdf")
+MODIFIED = struct.Struct("!d")
+FLAG_NEGATIVE = 1
+FLAG_MODIFIED = 2
+
+class Entry(NamedTuple):
+    codec: Any
+    body: bytes  # уже распакованное тело
+    exp: float = 0.0  # 0 - значение без логического срока (обычный cache_set)
+    dt: float = 0.0
+    negative: bool = False
+    modified: float = 0.0  # unix-время последнего изменения значения, 0 - неизвестно
+
+    def value(self) -> Any:
+        return None if self.negative else self.codec.loads(self.body)
+
+    def json_bytes(self) -> bytes | None:
+        if self.negative:
+            return None
+        return self.body if self.codec.is_json else JSON.dumps(self.value())
+
+def encode_entry(value: Any, exp: float = 0.0, dt: float = 0.0, modified: float = 0.0) -> tuple[bytes, Entry]:
+    negative = value is None and exp > 0
+    body = b"" if negative else codec.dumps(value)
+    packer = compression if len(body) >= CACHE_COMPRESS_MIN_BYTES else COMPRESSIONS["none"][0]
+    flags = (FLAG_NEGATIVE if negative else 0) | (FLAG_MODIFIED if modified else 0)
+    header = HEADER.pack(codec.id, packer.id, flags, exp, dt) + (MODIFIED.pack(modified) if modified else b"")
+    return MAGIC + header + packer.compress(body), Entry(codec, body, exp, dt, negative, modified)
+
+def decode_entry(data: bytes) -> Entry | None:
+    if not data.startswith(MAGIC):
+        # значение записано до появления кодеков
+        return Entry(JSON, data)
+    try:
+        codec_id, compression_id, flags, exp, dt = HEADER.unpack_from(data, len(MAGIC))
+        offset = len(MAGIC) + HEADER.size
+        modified = 0.0
+        if flags & FLAG_MODIFIED:
+            (modified,) = MODIFIED.unpack_from(data, offset)
+            offset += MODIFIED.size
+        entry_codec = _codecs_by_id[codec_id]
+        packer = _compressions_by_id[compression_id]
+        body = packer.decompress(data[offset:])
+    except Exception:
+        # чужой кодек/сжатие без установленной библиотеки или битое значение - считаем промахом
+        return None
+    return Entry(entry_codec, body, exp, dt, bool(flags & FLAG_NEGATIVE), modified)
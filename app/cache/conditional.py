@@ -0,0 +1,58 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import Request, Response
+
+# Условные GET: сильный ETag - хэш готового JSON из кэша, поэтому If-None-Match сверяется
+# без чтения строки из БД и без разбора тела. Last-Modified (только у отдельных объектов) - updated_at значения; оно считается
+# один раз при записи в кэш и хранится в заголовке записи (Entry.modified), так что ответ из кэша тело не разбирает.
+
+# Ответы персональные (за авторизацией) и всегда перепроверяются клиентом
+CACHE_CONTROL = "private, no-cache"
+
+def entity_tag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+def http_date(dt: datetime) -> str:
+    # в БД время хранится в UTC без зоны
+    return format_datetime(dt.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # для If-None-Match используется слабое сравнение: W/ перед тегом не учитывается
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def modified_since(if_modified_since: str, modified: datetime) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return True
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    # в заголовке время с точностью до секунды
+    return modified.replace(microsecond=0) > since
+
+def _timestamp(stamp: str | None) -> float:
+    # updated_at из тела (UTC без зоны) -> unix-время; 0 - неизвестно
+    if not stamp:
+        return 0.0
+    return datetime.fromisoformat(stamp).replace(tzinfo=timezone.utc).timestamp()
+
+def item_modified(value: dict) -> float:
+    return _timestamp(value.get("updated_at"))
+
+def conditional_json(request: Request, body: bytes, modified: float = 0.0) -> Response:
+    etag = entity_tag(body)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    if modified:
+        modified_at = datetime.fromtimestamp(modified, timezone.utc).replace(tzinfo=None)
+        headers["Last-Modified"] = http_date(modified_at)
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_none_match is None and if_modified_since and not modified_since(if_modified_since, modified_at):
+            return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
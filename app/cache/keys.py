@@ -0,0 +1,10 @@
+# Ключи кэша, которые сбрасывают не только ручки API, но и фоновые процессы и консольные утилиты
+# (воркер отложенной записи, массовая загрузка), - без импорта роутеров
+
+def comments_version_key(news_id: int) -> str:
+    # версия страниц комментариев новости: её смена сбрасывает все закэшированные страницы разом
+    return f"comments:{news_id}:version"
+
+def user_cache_key(user_id: int) -> str:
+    # публичный профиль пользователя (GET /api/users/{id}); не путать с user:{id} авторизации
+    return f"user_profile:{user_id}"
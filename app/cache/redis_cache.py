@@ -1,19 +1,378 @@
-import json
-from typing import Any, Optional
-from app.db.db import redis_client
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+from app.db.db import redis_bytes_client, redis_client
+from app.cache.codecs import Entry, decode_entry, encode_entry
+from app.metrics import CACHE_REQUESTS, key_prefix
 
-def cache_set(key: str, value: Any, ttl: int | None = None):
-    data = json.dumps(value, ensure_ascii=False, default=str)
-    redis_client.set(key, data, ex=ttl)
+logger = logging.getLogger(__name__)
 
-def cache_get(key: str) -> Optional[Any]:
-    raw = redis_client.get(key)
-    if raw is None:
+# L1 - кэш в памяти процесса перед Redis. Выключен при CACHE_L1_SIZE=0.
+# В L1 хранятся распакованные Entry, значение декодируется при каждом чтении.
+CACHE_L1_SIZE = int(os.getenv("CACHE_L1_SIZE", "0"))
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", "5"))
+# Канал, через который воркеры сообщают друг другу об изменённых ключах
+INVALIDATION_CHANNEL = "cache:invalidate"
+WORKER_ID = uuid.uuid4().hex
+
+class LocalCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        item = self._data.get(key)
+        if item is None:
+            return False, None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def set(self, key: str, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+l1_cache = LocalCache(CACHE_L1_SIZE, CACHE_L1_TTL)
+# Счётчики попаданий по уровням: l1_hit/l1_miss, l2_hit/l2_miss
+cache_stats: Counter = Counter()
+
+async def _set_entry(
+    key: str, value: Any, ttl: int | None, exp: float = 0.0, dt: float = 0.0, modified: float = 0.0
+) -> Entry:
+    data, entry = encode_entry(value, exp, dt, modified)
+    try:
+        if not CACHE_L1_SIZE:
+            await redis_bytes_client.set(key, data, ex=ttl)
+        else:
+            l1_cache.set(key, entry)
+            pipe = redis_bytes_client.pipeline(transaction=False)
+            pipe.set(key, data, ex=ttl)
+            pipe.publish(INVALIDATION_CHANNEL, f"{WORKER_ID}:{key}")
+            await pipe.execute()
+    except Exception:
+        CACHE_REQUESTS.labels("set", key_prefix(key), "error").inc()
+        raise
+    CACHE_REQUESTS.labels("set", key_prefix(key), "ok").inc()
+    return entry
+
+def _l1_lookup(key: str) -> tuple[bool, Entry | None]:
+    if not CACHE_L1_SIZE:
+        return False, None
+    hit, entry = l1_cache.get(key)
+    if hit:
+        cache_stats["l1_hit"] += 1
+        CACHE_REQUESTS.labels("get", key_prefix(key), "hit").inc()
+    else:
+        cache_stats["l1_miss"] += 1
+    return hit, entry
+
+def _accept(key: str, data: bytes | None) -> Entry | None:
+    # ответ Redis на чтение ключа: учёт попадания и заполнение L1
+    entry = decode_entry(data) if data is not None else None
+    if entry is None:
+        cache_stats["l2_miss"] += 1
+        CACHE_REQUESTS.labels("get", key_prefix(key), "miss").inc()
+        return None
+    cache_stats["l2_hit"] += 1
+    CACHE_REQUESTS.labels("get", key_prefix(key), "hit").inc()
+    if CACHE_L1_SIZE:
+        l1_cache.set(key, entry)
+    return entry
+
+async def _get_entry(key: str) -> Entry | None:
+    hit, entry = _l1_lookup(key)
+    if hit:
+        return entry
+    try:
+        data = await redis_bytes_client.get(key)
+    except Exception:
+        CACHE_REQUESTS.labels("get", key_prefix(key), "error").inc()
+        raise
+    return _accept(key, data)
+
+async def cache_get_many(keys: list[str]) -> list[Entry | None]:
+    # Несколько ключей за один MGET; в Redis идут только промахи L1
+    entries: list[Entry | None] = [None] * len(keys)
+    missing = []
+    for i, key in enumerate(keys):
+        hit, entries[i] = _l1_lookup(key)
+        if not hit:
+            missing.append(i)
+    if not missing:
+        return entries
+    try:
+        values = await redis_bytes_client.mget([keys[i] for i in missing])
+    except Exception:
+        for i in missing:
+            CACHE_REQUESTS.labels("get", key_prefix(keys[i]), "error").inc()
+        raise
+    for i, data in zip(missing, values):
+        entries[i] = _accept(keys[i], data)
+    return entries
+
+async def cache_set(key: str, value: Any, ttl: int | None = None, *, modified: float = 0.0):
+    # modified - время изменения значения для Last-Modified, см. app/cache/conditional.py
+    await _set_entry(key, value, ttl, modified=modified)
+
+async def cache_get(key: str) -> Optional[Any]:
+    entry = await _get_entry(key)
+    if entry is None:
         return None
     try:
-        return json.loads(raw)
-    except json.JSONDecodeError:
+        return entry.value()
+    except ValueError:
         return None
 
-def cache_delete(key: str):
-    redis_client.delete(key)
+async def cache_get_raw(key: str) -> bytes | None:
+    # Закодированный JSON без промежуточных объектов Python - его можно сразу отдавать клиентом
+    entry = await _get_entry(key)
+    return entry.json_bytes() if entry is not None else None
+
+async def cache_peek(key: str) -> Entry | None:
+    # Запись без загрузки при промахе; устаревшая (после exp) считается промахом
+    entry = await _get_entry(key)
+    if entry is None or (entry.exp and entry.exp < time.time()):
+        return None
+    return entry
+
+async def cache_delete(*keys: str):
+    if not keys:
+        return
+    try:
+        if not CACHE_L1_SIZE:
+            await redis_bytes_client.delete(*keys)
+        else:
+            pipe = redis_bytes_client.pipeline(transaction=False)
+            pipe.delete(*keys)
+            for key in keys:
+                l1_cache.delete(key)
+                pipe.publish(INVALIDATION_CHANNEL, f"{WORKER_ID}:{key}")
+            await pipe.execute()
+    except Exception:
+        for key in keys:
+            CACHE_REQUESTS.labels("delete", key_prefix(key), "error").inc()
+        raise
+    for key in keys:
+        CACHE_REQUESTS.labels("delete", key_prefix(key), "ok").inc()
+
+def cache_stats_snapshot() -> dict:
+    return {
+        "l1_enabled": bool(CACHE_L1_SIZE),
+        "l1_size": len(l1_cache),
+        **{name: cache_stats[name] for name in ("l1_hit", "l1_miss", "l2_hit", "l2_miss")},
+    }
+
+async def _listen_invalidations():
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            # пока подписки не было, сообщения могли потеряться - L1 начинаем с чистого листа
+            l1_cache.clear()
+            async for message in pubsub.listen():
+                worker_id, _, key = message["data"].partition(":")
+                if worker_id != WORKER_ID:
+                    l1_cache.delete(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("cache invalidation listener failed, resubscribing")
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
+
+def start_invalidation_listener() -> asyncio.Task | None:
+    if not CACHE_L1_SIZE:
+        return None
+    return asyncio.create_task(_listen_invalidations())
+
+# Версионированная инвалидация: номер версии входит в ключи кэша группы записей,
+# поэтому инкремент версии разом делает все старые ключи недостижимыми (они доживают свой TTL)
+async def cache_version(key: str) -> int:
+    raw = await redis_client.get(key)
+    return int(raw) if raw else 0
+
+async def cache_bump_version(*keys: str):
+    if not keys:
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.incr(key)
+    await pipe.execute()
+
+# Чтение с защитой от stampede. Вместе со значением хранятся логическое истечение exp и время расчёта dt:
+# - физический TTL больше логического на stale_ttl, и пока один воркер пересчитывает значение под блокировкой,
+#   остальные отдают устаревшее (stale-while-revalidate);
+# - незадолго до exp значение вероятностно пересчитывается заранее (XFetch), тем раньше, чем дороже расчёт;
+# - loader, вернувший None, кэшируется на negative_ttl, чтобы запросы несуществующих id не шли в БД.
+# С raw=True возвращается готовый JSON в байтах (см. cache_get_raw).
+
+_RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+_release_lock = redis_client.register_script(_RELEASE_LOCK)
+
+async def release_lock(lock_key: str, token: str):
+    # Снимает блокировку, только если она всё ещё наша: после истечения TTL её мог взять другой воркер
+    await _release_lock(keys=[lock_key], args=[token])
+
+# Запросы одного воркера к одному ключу ждут общий пересчёт, а не запускают свои
+_inflight: dict[str, asyncio.Future] = {}
+
+class _LoadAbandoned(Exception):
+    # загружавший запрос отменён: ожидающие загружают значение сами
+    pass
+
+def _should_refresh(entry: Entry, beta: float) -> bool:
+    return time.time() - entry.dt * beta * math.log(1.0 - random.random()) >= entry.exp
+
+def _result(entry: Entry, raw: bool) -> Any:
+    return entry.json_bytes() if raw else entry.value()
+
+async def cache_fill(
+    key: str, value: Any, ttl: int, *, stale_ttl: int = 60, negative_ttl: int = 30, dt: float = 0.0,
+    modified: float = 0.0,
+) -> Entry:
+    if value is None:
+        return await _set_entry(key, None, negative_ttl, exp=time.time() + negative_ttl, dt=dt)
+    return await _set_entry(key, value, ttl + stale_ttl, exp=time.time() + ttl, dt=dt, modified=modified)
+
+async def cache_fill_many(
+    values: dict[str, Any], ttl: int, *, stale_ttl: int = 60, last_modified: Callable[[Any], float] | None = None
+):
+    # Как cache_fill для нескольких ключей, одним пайплайном
+    if not values:
+        return
+    pipe = redis_bytes_client.pipeline(transaction=False)
+    exp = time.time() + ttl
+    for key, value in values.items():
+        data, entry = encode_entry(value, exp, 0.0, last_modified(value) if last_modified else 0.0)
+        pipe.set(key, data, ex=ttl + stale_ttl)
+        if CACHE_L1_SIZE:
+            l1_cache.set(key, entry)
+            pipe.publish(INVALIDATION_CHANNEL, f"{WORKER_ID}:{key}")
+    try:
+        await pipe.execute()
+    except Exception:
+        for key in values:
+            CACHE_REQUESTS.labels("set", key_prefix(key), "error").inc()
+        raise
+    for key in values:
+        CACHE_REQUESTS.labels("set", key_prefix(key), "ok").inc()
+
+async def cache_get_or_load(
+    key: str,
+    loader: Callable[[], Awaitable[Any]],
+    ttl: int,
+    *,
+    raw: bool = False,
+    **options,
+) -> Optional[Any]:
+    return _result(await cache_get_or_load_entry(key, loader, ttl, **options), raw)
+
+async def cache_get_or_load_entry(
+    key: str,
+    loader: Callable[[], Awaitable[Any]],
+    ttl: int,
+    *,
+    stale_ttl: int = 60,
+    negative_ttl: int = 30,
+    lock_ttl: float = 10.0,
+    beta: float = 1.0,
+    last_modified: Callable[[Any], float] | None = None,
+) -> Entry:
+    # То же, что cache_get_or_load, но возвращает саму запись: с ней доступны и тело, и Entry.modified.
+    # last_modified вычисляет время изменения загруженного значения для заголовка записи.
+    entry = await _get_entry(key)
+    if entry is not None and entry.exp:
+        if not _should_refresh(entry, beta):
+            return entry
+    else:
+        entry = None
+
+    if key in _inflight:
+        if entry is not None:
+            return entry
+        try:
+            return await asyncio.shield(_inflight[key])
+        except _LoadAbandoned:
+            # загружавший запрос отменён (например, клиент отключился) - повторяем поиск и загрузку сами
+            return await cache_get_or_load_entry(
+                key, loader, ttl, stale_ttl=stale_ttl, negative_ttl=negative_ttl, lock_ttl=lock_ttl,
+                beta=beta, last_modified=last_modified,
+            )
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        entry = await _load_under_lock(key, loader, entry, ttl, stale_ttl, negative_ttl, lock_ttl, last_modified)
+    except asyncio.CancelledError:
+        # отменён только этот запрос, а не загрузка для ожидающих: их loader завязан на сессию
+        # отменённого запроса, поэтому каждый из них загрузит значение заново
+        future.set_exception(_LoadAbandoned())
+        future.exception()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # исключение уже получит вызывающий, ожидающих может и не быть
+        future.exception()
+        raise
+    else:
+        future.set_result(entry)
+        return entry
+    finally:
+        del _inflight[key]
+
+async def _load_under_lock(key, loader, entry, ttl, stale_ttl, negative_ttl, lock_ttl, last_modified) -> Entry:
+    lock_key = f"lock:{key}"
+    token = uuid.uuid4().hex
+    if not await redis_client.set(lock_key, token, nx=True, px=int(lock_ttl * 1000)):
+        # значение пересчитывает другой воркер: отдаём устаревшее, если оно есть
+        if entry is not None:
+            return entry
+        deadline = time.monotonic() + lock_ttl
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            fresh = await _get_entry(key)
+            if fresh is not None and fresh.exp:
+                return fresh
+            if not await redis_client.exists(lock_key):
+                break
+        # блокировка истекла или держатель упал - считаем сами
+        return await _load_and_fill(key, loader, ttl, stale_ttl, negative_ttl, last_modified)
+
+    try:
+        return await _load_and_fill(key, loader, ttl, stale_ttl, negative_ttl, last_modified)
+    finally:
+        await release_lock(lock_key, token)
+
+async def _load_and_fill(key, loader, ttl, stale_ttl, negative_ttl, last_modified) -> Entry:
+    start = time.perf_counter()
+    value = await loader()
+    dt = time.perf_counter() - start
+    modified = last_modified(value) if last_modified and value is not None else 0.0
+    return await cache_fill(key, value, ttl, stale_ttl=stale_ttl, negative_ttl=negative_ttl, dt=dt, modified=modified)
@@ -0,0 +1,191 @@
+"""Рейтинг «обсуждают сейчас»: оценка новостей с затуханием во времени в Redis sorted set.
+
+    python -m app.cache.trending reconcile
+    python -m app.cache.trending reconcile --force
+
+Каждое событие добавляет к оценке новости вес, умноженный на 2^((t - epoch) / TRENDING_HALF_LIFE):
+так событие, случившееся на период полураспада раньше, весит вдвое меньше, а пересчитывать старые
+оценки не нужно. Чтобы множитель не рос неограниченно, epoch периодически сдвигается вперёд, а все
+оценки одной командой делятся на тот же множитель.
+
+Комментарии учитываются при создании и удалении, просмотры (get_news) копятся в памяти процесса и
+отправляются пачкой раз в TRENDING_FLUSH_SECONDS. Если рейтинга в Redis нет (после сброса Redis),
+фоновая задача пересобирает его по комментариям из Postgres; просмотры при этом не восстанавливаются.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from sqlalchemy import func, select
+from app.db.db import AsyncSessionLocal, redis_client
+from app.cache.redis_cache import release_lock
+from app.models.comment import Comment
+
+logger = logging.getLogger(__name__)
+
+TRENDING_HALF_LIFE = float(os.getenv("TRENDING_HALF_LIFE", "21600"))  # секунд, 6 часов
+TRENDING_COMMENT_WEIGHT = float(os.getenv("TRENDING_COMMENT_WEIGHT", "3"))
+TRENDING_VIEW_WEIGHT = float(os.getenv("TRENDING_VIEW_WEIGHT", "1"))
+TRENDING_MAX_ITEMS = int(os.getenv("TRENDING_MAX_ITEMS", "1000"))
+TRENDING_FLUSH_SECONDS = float(os.getenv("TRENDING_FLUSH_SECONDS", "1"))
+TRENDING_RECONCILE_SECONDS = float(os.getenv("TRENDING_RECONCILE_SECONDS", "60"))
+# При пересборке учитываются комментарии за это окно: более старые весят меньше 2^-28
+TRENDING_REBUILD_HALF_LIVES = 28
+# epoch сдвигается, когда множитель доходит до 2^TRENDING_REBASE_HALF_LIVES
+TRENDING_REBASE_HALF_LIVES = 32
+
+SCORES_KEY = "trending:scores"
+EPOCH_KEY = "trending:epoch"
+REBUILD_KEY = "trending:scores:rebuild"
+RECONCILE_LOCK_KEY = "lock:trending:reconcile"
+
+# Без epoch рейтинг считается потерянным: приращения не пишутся, пока его не пересоберут
+_INCREMENT = """
+local epoch = redis.call("GET", KEYS[2])
+if not epoch then
+    return 0
+end
+local factor = tonumber(ARGV[1])
+for i = 2, #ARGV, 3 do
+    local weight = tonumber(ARGV[i + 1]) * math.pow(2, (tonumber(ARGV[i + 2]) - tonumber(epoch)) / factor)
+    redis.call("ZINCRBY", KEYS[1], weight, ARGV[i])
+end
+return 1
+"""
+_increment = redis_client.register_script(_INCREMENT)
+
+def _timestamp(value: datetime) -> float:
+    # время в БД хранится в UTC без часового пояса
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+async def _add(events: list[tuple[int, float, float]]):
+    # (news_id, вес, время события)
+    if not events:
+        return
+    args = [TRENDING_HALF_LIFE]
+    for news_id, weight, at in events:
+        args += [news_id, weight, at]
+    await _increment(keys=[SCORES_KEY, EPOCH_KEY], args=args)
+
+async def record_comments(comments: list[tuple[int, datetime]], sign: int = 1):
+    # Удаление вычитает ровно то, что добавило создание: вес считается по времени публикации
+    await _add([(news_id, sign * TRENDING_COMMENT_WEIGHT, _timestamp(at)) for news_id, at in comments])
+
+_views: Counter = Counter()
+
+def record_view(news_id: int):
+    _views[news_id] += 1
+
+async def flush_views():
+    if not _views:
+        return
+    now = time.time()
+    views = dict(_views)
+    _views.clear()
+    await _add([(news_id, count * TRENDING_VIEW_WEIGHT, now) for news_id, count in views.items()])
+
+async def forget(*news_ids: int):
+    if news_ids:
+        await redis_client.zrem(SCORES_KEY, *news_ids)
+
+async def top(limit: int) -> list[tuple[int, float]]:
+    # (news_id, оценка на текущий момент)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(EPOCH_KEY)
+    pipe.zrevrange(SCORES_KEY, 0, limit - 1, withscores=True)
+    epoch, items = await pipe.execute()
+    if epoch is None:
+        return []
+    scale = math.pow(2, (time.time() - float(epoch)) / TRENDING_HALF_LIFE)
+    # после удаления всех комментариев от оценки остаётся только погрешность округления
+    return [(int(news_id), score / scale) for news_id, score in items if score / scale > 1e-6]
+
+async def rebuild() -> int:
+    epoch = time.time()
+    since = datetime.utcfromtimestamp(epoch - TRENDING_REBUILD_HALF_LIVES * TRENDING_HALF_LIFE)
+    epoch_at = datetime.utcfromtimestamp(epoch)
+    # условие на published_at отсекает старые секции comments
+    weight = func.sum(func.power(2, func.extract("epoch", Comment.published_at - epoch_at) / TRENDING_HALF_LIFE))
+    stmt = (
+        select(Comment.news_id, (weight * TRENDING_COMMENT_WEIGHT).label("score"))
+        .where(Comment.published_at >= since)
+        .group_by(Comment.news_id)
+        .order_by(weight.desc())
+        .limit(TRENDING_MAX_ITEMS)
+    )
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(stmt)).all()
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(REBUILD_KEY)
+    if rows:
+        pipe.zadd(REBUILD_KEY, {str(news_id): float(score) for news_id, score in rows})
+        pipe.rename(REBUILD_KEY, SCORES_KEY)
+    else:
+        pipe.delete(SCORES_KEY)
+    pipe.set(EPOCH_KEY, epoch)
+    await pipe.execute()
+    return len(rows)
+
+async def _rebase(epoch: float):
+    # Все оценки умножаются на 2^-(сдвиг epoch) одной командой, вместе с новым epoch
+    new_epoch = time.time()
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.zunionstore(SCORES_KEY, {SCORES_KEY: math.pow(2, (epoch - new_epoch) / TRENDING_HALF_LIFE)})
+    pipe.set(EPOCH_KEY, new_epoch)
+    await pipe.execute()
+
+async def reconcile(force: bool = False) -> dict:
+    # Один воркер за раз; остальные пропускают проверку
+    token = uuid.uuid4().hex
+    if not await redis_client.set(RECONCILE_LOCK_KEY, token, nx=True, ex=int(TRENDING_RECONCILE_SECONDS) or 1):
+        return {"action": "skipped"}
+    try:
+        epoch = await redis_client.get(EPOCH_KEY)
+        if force or epoch is None:
+            return {"action": "rebuilt", "items": await rebuild()}
+        if time.time() - float(epoch) > TRENDING_REBASE_HALF_LIVES * TRENDING_HALF_LIFE:
+            await _rebase(float(epoch))
+            action = "rebased"
+        else:
+            action = "checked"
+        await redis_client.zremrangebyrank(SCORES_KEY, 0, -TRENDING_MAX_ITEMS - 1)
+        return {"action": action}
+    finally:
+        await release_lock(RECONCILE_LOCK_KEY, token)
+
+async def _maintain():
+    next_reconcile = 0.0
+    while True:
+        try:
+            await flush_views()
+            if time.monotonic() >= next_reconcile:
+                next_reconcile = time.monotonic() + TRENDING_RECONCILE_SECONDS
+                result = await reconcile()
+                if result["action"] in ("rebuilt", "rebased"):
+                    logger.info("trending scores %s", result["action"])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("trending maintenance failed")
+        await asyncio.sleep(TRENDING_FLUSH_SECONDS)
+
+def start_trending_maintenance() -> asyncio.Task:
+    return asyncio.create_task(_maintain())
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.cache.trending", description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_reconcile = sub.add_parser("reconcile", help="rebuild trending scores from Postgres if they are missing")
+    p_reconcile.add_argument("--force", action="store_true", help="rebuild even if scores exist (drops view scores)")
+    args = parser.parse_args(argv)
+    print(json.dumps(asyncio.run(reconcile(force=args.force))))
+
+if __name__ == "__main__":
+    main()
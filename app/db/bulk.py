@@ -0,0 +1,336 @@
+"""Массовая загрузка и выгрузка таблиц через COPY.
+
+    python -m app.db.bulk import users users.ndjson
+    python -m app.db.bulk import comments comments.csv --rejects rejected.csv
+    python -m app.db.bulk export news -o news.ndjson
+
+Загрузка: строки (NDJSON или CSV с заголовком) потоком идут через COPY FROM STDIN во временную
+таблицу, затем одним INSERT ... ON CONFLICT переносятся в рабочую. Строки, ссылающиеся на
+несуществующих авторов/новости, не загружаются и при необходимости сохраняются в --rejects.
+После commit из кэша удаляются загруженные пользователи и новости, а у новостей с загруженными
+комментариями сбрасывается версия страниц комментариев.
+Выгрузка: COPY TO STDOUT в CSV или NDJSON. Память в обоих случаях не зависит от объёма данных.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import logging
+import sys
+from dataclasses import dataclass
+from typing import Iterable, Iterator, TextIO
+from app.db.db import engine
+from app.cache.redis_cache import cache_bump_version, cache_delete
+from app.cache.keys import comments_version_key, user_cache_key
+
+logger = logging.getLogger(__name__)
+
+# ключей кэша за одну команду Redis при инвалидации после загрузки
+INVALIDATE_BATCH = 1000
+
+@dataclass(frozen=True)
+class TableSpec:
+    name: str
+    columns: dict[str, str]  # колонка -> тип во временной таблице
+    conflict: str  # уникальный ключ для upsert
+    defaults: dict[str, str]  # выражения для пропущенных значений
+    references: dict[str, str]  # колонка -> таблица, на id которой она ссылается
+    partition_key: str | None = None  # ключ секционирования: входит в уникальный ключ рядом с conflict
+    touched: str = "id"  # колонка, по которой после загрузки инвалидируется кэш
+
+TABLES = {
+    "users": TableSpec(
+        name="users",
+        columns={
+            "id": "integer",
+            "name": "text",
+            "email": "text",
+            "registered_at": "timestamp",
+            "is_verified_author": "boolean",
+            "avatar_url": "text",
+            "password_hash": "text",
+            "is_admin": "boolean",
+        },
+        conflict="email",
+        defaults={
+            "registered_at": "(now() at time zone 'utc')",
+            "is_verified_author": "false",
+            "is_admin": "false",
+        },
+        references={},
+    ),
+    "news": TableSpec(
+        name="news",
+        columns={
+            "id": "integer",
+            "title": "text",
+            "content": "jsonb",
+            "published_at": "timestamp",
+            "cover_url": "text",
+            "author_id": "integer",
+        },
+        conflict="id",
+        defaults={"published_at": "(now() at time zone 'utc')"},
+        references={"author_id": "users"},
+    ),
+    "comments": TableSpec(
+        name="comments",
+        columns={
+            "id": "integer",
+            "text": "text",
+            "published_at": "timestamp",
+            "news_id": "integer",
+            "author_id": "integer",
+        },
+        conflict="id",
+        defaults={"published_at": "(now() at time zone 'utc')"},
+        references={"news_id": "news", "author_id": "users"},
+        partition_key="published_at",
+        touched="news_id",
+    ),
+}
+
+class _IterFile(io.TextIOBase):
+    # Файлоподобная обёртка над генератором строк: copy_expert читает её кусками
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self._buffer = ""
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self._buffer = self._buffer, ""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size: int = -1) -> str:
+        return self.read(size)
+
+def _csv_field(value) -> str:
+    # None - пустое поле без кавычек (NULL для COPY), всё остальное, кроме чисел, в кавычках
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return '"' + str(value).replace('"', '""') + '"'
+
+def _ndjson_to_csv(lines: Iterable[str], columns: list[str]) -> Iterator[str]:
+    batch = []
+    for line in lines:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        batch.append(",".join(_csv_field(row.get(c)) for c in columns) + "\n")
+        if len(batch) >= 1000:
+            yield "".join(batch)
+            batch = []
+    yield "".join(batch)
+
+def _detect_format(path: str, fmt: str | None) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.endswith(".csv") else "ndjson"
+
+def import_table(table: str, src: TextIO, fmt: str, rejects: TextIO | None = None) -> dict:
+    spec = TABLES[table]
+    staging = f"staging_{spec.name}"
+    touched = f"touched_{spec.name}"
+    if fmt == "csv":
+        header = next(csv.reader([src.readline()]))
+        unknown = set(header) - set(spec.columns)
+        if unknown:
+            raise ValueError(f"unknown columns for {table}: {sorted(unknown)}")
+        columns, source = header, src
+    else:
+        columns = list(spec.columns)
+        source = _IterFile(_ndjson_to_csv(src, columns))
+
+    column_defs = ", ".join(f"{c} {t}" for c, t in spec.columns.items())
+    fk_checks = " AND ".join(
+        f"EXISTS (SELECT 1 FROM {ref} r WHERE r.id = s.{col})" for col, ref in spec.references.items()
+    ) or "true"
+    # при повторе ключа в файле побеждает последняя строка
+    dedup_key = f"COALESCE(s.{spec.conflict}::text, '#' || s._line)"
+    select_list = ", ".join(
+        f"COALESCE(s.id, nextval(pg_get_serial_sequence('{spec.name}', 'id'))) AS id" if c == "id"
+        else f"COALESCE(s.{c}, {spec.defaults[c]}) AS {c}" if c in spec.defaults
+        else f"s.{c}"
+        for c in spec.columns
+    )
+    updates = ", ".join(
+        f"{c} = EXCLUDED.{c}" for c in spec.columns if c not in ("id", spec.conflict, spec.partition_key)
+    )
+    incoming = f"""
+        SELECT {select_list}
+        FROM (
+            SELECT DISTINCT ON ({dedup_key}) s.*
+            FROM {staging} s
+            ORDER BY {dedup_key}, s._line DESC
+        ) s
+        WHERE {fk_checks}
+    """
+    if spec.partition_key:
+        # В секционированной таблице уникален только (conflict, partition_key): строка, у которой
+        # поменялся ключ секционирования, переезжает - старая версия удаляется, новая вставляется
+        upsert = f"""
+            WITH incoming AS ({incoming}), moved AS (
+                DELETE FROM {spec.name} t USING incoming r
+                WHERE t.{spec.conflict} = r.{spec.conflict} AND t.{spec.partition_key} <> r.{spec.partition_key}
+            ), merged AS (
+                INSERT INTO {spec.name} ({', '.join(spec.columns)})
+                SELECT * FROM incoming
+                ON CONFLICT ({spec.conflict}, {spec.partition_key}) DO UPDATE SET {updates}
+                RETURNING {spec.touched}
+            )
+            INSERT INTO {touched} SELECT {spec.touched} FROM merged
+        """
+    else:
+        upsert = f"""
+            WITH merged AS (
+                INSERT INTO {spec.name} ({', '.join(spec.columns)})
+                {incoming}
+                ON CONFLICT ({spec.conflict}) DO UPDATE SET {updates}
+                RETURNING {spec.touched}
+            )
+            INSERT INTO {touched} SELECT {spec.touched} FROM merged
+        """
+
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.execute(f"CREATE TEMP TABLE {staging} ({column_defs}, _line bigserial) ON COMMIT DROP")
+        cur.copy_expert(
+            f"COPY {staging} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            source,
+            size=1 << 16,
+        )
+        cur.execute(f"SELECT count(*) FROM {staging}")
+        loaded = cur.fetchone()[0]
+
+        rejected = 0
+        if spec.references:
+            cur.execute(f"SELECT count(*) FROM {staging} s WHERE NOT ({fk_checks})")
+            rejected = cur.fetchone()[0]
+            if rejected and rejects is not None:
+                cur.copy_expert(
+                    f"COPY (SELECT {', '.join(spec.columns)} FROM {staging} s WHERE NOT ({fk_checks}) ORDER BY _line) "
+                    "TO STDOUT WITH (FORMAT csv, HEADER true)",
+                    rejects,
+                )
+
+        cur.execute(f"CREATE TEMP TABLE {touched} (key integer) ON COMMIT DROP")
+        if spec.touched != "id":
+            # прежние значения у обновляемых строк: комментарий мог переехать к другой новости
+            cur.execute(
+                f"INSERT INTO {touched} SELECT t.{spec.touched} FROM {spec.name} t JOIN {staging} s ON s.id = t.id"
+            )
+        cur.execute(upsert)
+        merged = cur.rowcount
+        cur.execute(f"SELECT DISTINCT key FROM {touched}")
+        touched_keys = [key for (key,) in cur.fetchall()]
+        # явно заданные id не двигают последовательность - подтягиваем её к максимуму
+        cur.execute(
+            f"SELECT setval(pg_get_serial_sequence('{spec.name}', 'id'), "
+            f"GREATEST((SELECT max(id) FROM {spec.name}), 1))"
+        )
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    try:
+        asyncio.run(invalidate_cache(table, touched_keys))
+    except Exception:
+        # данные уже загружены; устаревшие записи кэша доживут свой TTL
+        logger.exception("cache invalidation after import of %s failed", table)
+    return {"table": table, "loaded": loaded, "merged": merged, "rejected": rejected}
+
+def _cache_keys(table: str, key: int) -> list[str]:
+    if table == "users":
+        return [f"user:{key}", user_cache_key(key)]
+    if table == "news":
+        return [f"news:{key}"]
+    return [comments_version_key(key)]
+
+async def invalidate_cache(table: str, keys: list[int]):
+    # Загрузка идёт в обход API: удаляем записи кэша (включая закэшированные «не найдено» для новых id)
+    # и сбрасываем версии страниц комментариев, пачками по INVALIDATE_BATCH
+    for start in range(0, len(keys), INVALIDATE_BATCH):
+        cache_keys = [k for key in keys[start:start + INVALIDATE_BATCH] for k in _cache_keys(table, key)]
+        if table == "comments":
+            await cache_bump_version(*cache_keys)
+        else:
+            await cache_delete(*cache_keys)
+
+def export_table(table: str, dst: TextIO, fmt: str):
+    spec = TABLES[table]
+    query = f"SELECT {', '.join(spec.columns)} FROM {spec.name} ORDER BY id"
+    if fmt == "csv":
+        sql = f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+    else:
+        # row_to_json экранирует управляющие символы, поэтому \x01/\x02 в качестве кавычки
+        # и разделителя CSV никогда не встретятся и строки выходят без изменений
+        sql = (
+            f"COPY (SELECT row_to_json(t) FROM ({query}) t) "
+            "TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+        )
+    raw = engine.raw_connection()
+    try:
+        raw.cursor().copy_expert(sql, dst, size=1 << 16)
+        raw.commit()
+    finally:
+        raw.close()
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.db.bulk", description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="load NDJSON/CSV into a table")
+    p_import.add_argument("table", choices=list(TABLES))
+    p_import.add_argument("path", help="source file, '-' for stdin")
+    p_import.add_argument("--format", choices=["ndjson", "csv"])
+    p_import.add_argument("--rejects", help="write rows with missing references to this CSV file")
+
+    p_export = sub.add_parser("export", help="dump a table as NDJSON/CSV")
+    p_export.add_argument("table", choices=list(TABLES))
+    p_export.add_argument("-o", "--output", default="-", help="target file, '-' for stdout")
+    p_export.add_argument("--format", choices=["ndjson", "csv"])
+
+    args = parser.parse_args(argv)
+    if args.command == "import":
+        fmt = _detect_format(args.path, args.format)
+        src = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8", newline="")
+        rejects = open(args.rejects, "w", encoding="utf-8", newline="") if args.rejects else None
+        try:
+            result = import_table(args.table, src, fmt, rejects)
+        finally:
+            if src is not sys.stdin:
+                src.close()
+            if rejects is not None:
+                rejects.close()
+        print(json.dumps(result))
+    else:
+        fmt = _detect_format(args.output, args.format)
+        dst = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+        try:
+            export_table(args.table, dst, fmt)
+        finally:
+            if dst is not sys.stdout:
+                dst.close()
+
+if __name__ == "__main__":
+    main()
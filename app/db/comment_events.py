@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from typing import AsyncIterator
+from app.db.db import redis_client
+from app.metrics import SSE_CLIENTS
+
+logger = logging.getLogger(__name__)
+
+# События комментариев новости для подписчиков (SSE). Каждое событие одним вызовом скрипта:
+# - дописывается в поток comment_events:{news_id} - история для возобновления по Last-Event-ID;
+# - публикуется в канал с тем же именем - для живых подписчиков.
+# Воркер держит одну подписку Redis на новость, сколько бы клиентов её ни слушали, и раздаёт события
+# по очередям клиентов в памяти, без запросов к БД.
+COMMENT_EVENTS_RETENTION = int(os.getenv("COMMENT_EVENTS_RETENTION", "600"))  # секунд истории
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# Отстающий клиент с переполненной очередью отключается и переподключается уже с Last-Event-ID
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "256"))
+
+def events_key(news_id: int) -> str:
+    return f"comment_events:{news_id}"
+
+_PUBLISH = """
+local id = redis.call("XADD", KEYS[1], "MINID", "~", ARGV[1], "*", "type", ARGV[2], "data", ARGV[3])
+redis.call("EXPIRE", KEYS[1], ARGV[4])
+redis.call("PUBLISH", KEYS[1], id .. "\\n" .. ARGV[2] .. "\\n" .. ARGV[3])
+return id
+"""
+_publish = redis_client.register_script(_PUBLISH)
+
+async def publish_comment_events(events: list[tuple[int, str, dict]]):
+    # (news_id, тип, данные) одним пайплайном
+    if not events:
+        return
+    min_id = int(time.time() * 1000) - COMMENT_EVENTS_RETENTION * 1000
+    pipe = redis_client.pipeline(transaction=False)
+    for news_id, event, data in events:
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        await _publish(keys=[events_key(news_id)], args=[min_id, event, payload, COMMENT_EVENTS_RETENTION], client=pipe)
+    await pipe.execute()
+
+async def publish_comment_event(news_id: int, event: str, data: dict):
+    await publish_comment_events([(news_id, event, data)])
+
+EVENT_ID_RE = re.compile(r"^\d+(-\d+)?$")
+
+def _id_key(event_id: str) -> tuple[int, int]:
+    ms, _, seq = event_id.partition("-")
+    return int(ms), int(seq or 0)
+
+class CommentEventHub:
+    def __init__(self):
+        self.subscribers: dict[int, set[asyncio.Queue]] = {}
+        self.pubsub = None
+        self.listener: asyncio.Task | None = None
+        self.lock = asyncio.Lock()
+
+    async def subscribe(self, news_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        async with self.lock:
+            clients = self.subscribers.setdefault(news_id, set())
+            clients.add(queue)
+            if len(clients) == 1:
+                if self.pubsub is None:
+                    self.pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                await self.pubsub.subscribe(events_key(news_id))
+            if self.listener is None or self.listener.done():
+                self.listener = asyncio.create_task(self._listen())
+        SSE_CLIENTS.inc()
+        return queue
+
+    async def unsubscribe(self, news_id: int, queue: asyncio.Queue):
+        SSE_CLIENTS.dec()
+        async with self.lock:
+            clients = self.subscribers.get(news_id)
+            if clients is None:
+                return
+            clients.discard(queue)
+            if not clients:
+                del self.subscribers[news_id]
+                if self.pubsub is not None:
+                    await self.pubsub.unsubscribe(events_key(news_id))
+
+    async def _listen(self):
+        try:
+            async for message in self.pubsub.listen():
+                news_id = int(message["channel"].rpartition(":")[2])
+                event_id, event, data = message["data"].split("\n", 2)
+                clients = self.subscribers.get(news_id, set())
+                for queue in list(clients):
+                    try:
+                        queue.put_nowait((event_id, event, data))
+                    except asyncio.QueueFull:
+                        clients.discard(queue)
+                        self._drop(queue)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Пока подписки нет, события теряются - отключаем всех: клиенты переподключатся
+            # с Last-Event-ID и дочитают пропущенное из истории
+            logger.exception("comment events listener failed")
+            await self._reset()
+
+    @staticmethod
+    def _drop(queue: asyncio.Queue):
+        # освобождаем место под сигнал отключения, остальное клиент дочитает из истории
+        queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def _reset(self):
+        async with self.lock:
+            for clients in self.subscribers.values():
+                for queue in clients:
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+            self.subscribers.clear()
+            pubsub, self.pubsub = self.pubsub, None
+        if pubsub is not None:
+            await pubsub.aclose()
+
+hub = CommentEventHub()
+
+def _sse(event_id: str, event: str, data: str) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
+async def comment_events(news_id: int, last_event_id: str | None) -> AsyncIterator[str]:
+    # Подписка оформляется до чтения истории, чтобы не потерять события между ними;
+    # повторы отсекаются по id
+    queue = await hub.subscribe(news_id)
+    try:
+        yield "retry: 3000\n\n"
+        last = _id_key(last_event_id) if last_event_id else None
+        if last is not None:
+            now_ms = int(time.time() * 1000)
+            if last[0] < now_ms - COMMENT_EVENTS_RETENTION * 1000:
+                # пропущенное уже вышло из истории - клиенту нужно заново загрузить список,
+                # а следующее переподключение продолжит с этого момента
+                yield _sse(f"{now_ms}-0", "reset", "{}")
+                last = (now_ms, 0)
+            else:
+                for event_id, fields in await redis_client.xrange(events_key(news_id), f"({last_event_id}", "+"):
+                    yield _sse(event_id, fields["type"], fields["data"])
+                    last = _id_key(event_id)
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # комментарий SSE держит соединение живым через прокси
+                yield ": ping\n\n"
+                continue
+            if item is None:
+                return
+            event_id, event, data = item
+            if last is not None and _id_key(event_id) <= last:
+                continue
+            yield _sse(event_id, event, data)
+    finally:
+        await hub.unsubscribe(news_id, queue)
@@ -0,0 +1,296 @@
+"""Воркер отложенной записи комментариев из Redis Stream в БД.
+
+    python -m app.db.comment_ingest
+    python -m app.db.comment_ingest --consumer writer-2 --metrics-port 9102
+
+Воркеры группы COMMENTS_GROUP забирают записи потока COMMENTS_STREAM пачками до COMMENTS_BATCH_SIZE
+и вставляют их одним INSERT ... RETURNING. Запись подтверждается (XACK) только после commit. Если воркер
+упал раньше, запись остаётся среди ожидающих, и через COMMENTS_CLAIM_IDLE_MS её забирает XAUTOCLAIM.
+Повторная вставка ничего не меняет благодаря уникальному ключу (client_id, published_at), а побочные
+эффекты (версия страниц, trending, событие comment.created) для уже записанных строк выполняются снова:
+воркер мог упасть между commit и XACK. Комментарии к несуществующим новостям и пользователям, строки,
+которые отвергла БД, и записи, не записанные за COMMENTS_MAX_DELIVERIES доставок, переносятся в
+COMMENTS_DEAD_LETTER_STREAM.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+from prometheus_client import start_http_server
+from redis.exceptions import ResponseError
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from app.db.db import AsyncSessionLocal, async_engine, redis_client
+from app.db.comment_events import publish_comment_events
+from app.db.comment_stream import (
+    COMMENTS_DEAD_LETTER_STREAM, COMMENTS_GROUP, COMMENTS_REJECTED_TTL, COMMENTS_STREAM, rejected_key, stream_status,
+)
+from app.models.comment import Comment, comment_to_dict
+from app.models.news import News
+from app.models.user import User
+from app.cache import trending
+from app.cache.keys import comments_version_key
+from app.cache.redis_cache import cache_bump_version
+from app.metrics import (
+    COMMENT_INGEST_BATCH, COMMENT_STREAM_LAG, COMMENT_STREAM_LAG_SECONDS, COMMENT_STREAM_PENDING, COMMENTS_INGESTED,
+    instrument_engine, instrument_redis,
+)
+
+logger = logging.getLogger(__name__)
+
+COMMENTS_BATCH_SIZE = int(os.getenv("COMMENTS_BATCH_SIZE", "500"))
+COMMENTS_BLOCK_MS = int(os.getenv("COMMENTS_BLOCK_MS", "1000"))
+# записи, не подтверждённые столько миллисекунд, считаются брошенными упавшим воркером
+COMMENTS_CLAIM_IDLE_MS = int(os.getenv("COMMENTS_CLAIM_IDLE_MS", "30000"))
+# после стольких доставок без записи в БД (упавшие пачки) запись уходит в COMMENTS_DEAD_LETTER_STREAM
+COMMENTS_MAX_DELIVERIES = int(os.getenv("COMMENTS_MAX_DELIVERIES", "5"))
+LAG_REPORT_INTERVAL = 5
+
+def _parse(fields: dict) -> dict:
+    return {
+        "client_id": uuid.UUID(fields["client_id"]),
+        "news_id": int(fields["news_id"]),
+        "author_id": int(fields["author_id"]),
+        "text": fields["text"],
+        "published_at": datetime.fromisoformat(fields["published_at"]),
+    }
+
+def _insert(rows: list[dict]):
+    return (
+        insert(Comment)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["client_id", "published_at"])
+        .returning(*Comment.__table__.c)
+    )
+
+class Batch:
+    def __init__(self, messages: list[tuple[str, dict]]):
+        self.ids = [message_id for message_id, _ in messages]
+        self.rows: dict[str, dict] = {}  # id записи потока -> строка для вставки
+        self.rejected: dict[str, tuple[dict, str]] = {}  # id записи -> (поля, причина)
+        self.inserted: list[tuple] = []
+        self.redelivered: list[tuple] = []  # строки, записанные при прошлой доставке
+        for message_id, fields in messages:
+            try:
+                self.rows[message_id] = _parse(fields)
+            except (KeyError, ValueError) as e:
+                self.rejected[message_id] = (fields, f"malformed: {e}")
+
+    def reject(self, message_id: str, reason: str):
+        row = self.rows.pop(message_id)
+        self.rejected[message_id] = ({k: str(v) for k, v in row.items()}, reason)
+
+async def _write(batch: Batch):
+    async with AsyncSessionLocal() as db:
+        rows = list(batch.rows.values())
+        # Внешние ключи проверяются для всей пачки двумя запросами, а не ошибкой на первой же строке
+        news_ids = set(await db.scalars(select(News.id).where(News.id.in_({r["news_id"] for r in rows}))))
+        user_ids = set(await db.scalars(select(User.id).where(User.id.in_({r["author_id"] for r in rows}))))
+        for message_id, row in list(batch.rows.items()):
+            if row["news_id"] not in news_ids:
+                batch.reject(message_id, "News not found")
+            elif row["author_id"] not in user_ids:
+                batch.reject(message_id, "User not found")
+        if not batch.rows:
+            return
+        try:
+            async with db.begin_nested():
+                inserted = (await db.execute(_insert(list(batch.rows.values())))).all()
+        except (DataError, IntegrityError):
+            # новость удалили между проверкой и вставкой или строку не приняла БД - пишем по одной,
+            # чтобы отсеять только виновные строки
+            inserted = []
+            for message_id, row in list(batch.rows.items()):
+                try:
+                    async with db.begin_nested():
+                        inserted += (await db.execute(_insert([row]))).all()
+                except (DataError, IntegrityError) as e:
+                    batch.reject(message_id, f"rejected by database: {e.orig}")
+        # строки, не вернувшиеся из RETURNING, уже были вставлены при прошлой доставке - читаем их,
+        # чтобы выполнить побочные эффекты, которые могли не дойти до конца
+        returned = {(row.client_id, row.published_at) for row in inserted}
+        missing = [
+            (row["client_id"], row["published_at"]) for row in batch.rows.values()
+            if (row["client_id"], row["published_at"]) not in returned
+        ]
+        redelivered = []
+        if missing:
+            redelivered = (await db.execute(
+                select(*Comment.__table__.c).where(tuple_(Comment.client_id, Comment.published_at).in_(missing))
+            )).all()
+        await db.commit()
+    batch.inserted = inserted
+    batch.redelivered = redelivered
+
+def _counted_key(client_id) -> str:
+    return f"comment_counted:{client_id}"
+
+async def _not_counted(rows: list[tuple]) -> list[tuple]:
+    # Вес в trending складывается, поэтому повторно доставленный комментарий учитывается только один раз:
+    # отметка ставится вместе с учётом и живёт столько же, сколько отметки об отклонении
+    pipe = redis_client.pipeline(transaction=False)
+    for row in rows:
+        pipe.set(_counted_key(row.client_id), 1, nx=True, ex=COMMENTS_REJECTED_TTL)
+    return [row for row, fresh in zip(rows, await pipe.execute()) if fresh]
+
+def _dead_letter(pipe, message_id: str, fields: dict, reason: str):
+    pipe.xadd(COMMENTS_DEAD_LETTER_STREAM, {**fields, "reason": reason, "source_id": message_id})
+    if "client_id" in fields:
+        pipe.set(rejected_key(fields["client_id"]), reason, ex=COMMENTS_REJECTED_TTL)
+
+async def process(messages: list[tuple[str, dict]]):
+    start = time.perf_counter()
+    batch = Batch(messages)
+    if batch.rows:
+        await _write(batch)
+    # смена версии безвредна при повторе, повторное событие comment.created несёт тот же id комментария
+    stored = batch.inserted + batch.redelivered
+    if stored:
+        await cache_bump_version(*{comments_version_key(row.news_id) for row in stored})
+        counted = await _not_counted(stored)
+        await trending.record_comments([(row.news_id, row.published_at) for row in counted])
+        await publish_comment_events([(row.news_id, "comment.created", comment_to_dict(row)) for row in stored])
+
+    pipe = redis_client.pipeline(transaction=False)
+    for message_id, (fields, reason) in batch.rejected.items():
+        _dead_letter(pipe, message_id, fields, reason)
+    # подтверждённые записи удаляются: в потоке остаются только не записанные в БД
+    pipe.xack(COMMENTS_STREAM, COMMENTS_GROUP, *batch.ids)
+    pipe.xdel(COMMENTS_STREAM, *batch.ids)
+    await pipe.execute()
+
+    COMMENT_INGEST_BATCH.observe(time.perf_counter() - start)
+    COMMENTS_INGESTED.labels("inserted").inc(len(batch.inserted))
+    COMMENTS_INGESTED.labels("duplicate").inc(len(batch.rows) - len(batch.inserted))
+    COMMENTS_INGESTED.labels("rejected").inc(len(batch.rejected))
+    if batch.rejected:
+        logger.warning("%d comments moved to %s", len(batch.rejected), COMMENTS_DEAD_LETTER_STREAM)
+
+async def ensure_group():
+    try:
+        await redis_client.xgroup_create(COMMENTS_STREAM, COMMENTS_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+async def _report_lag():
+    status = await stream_status()
+    if status["group"] is None:
+        return
+    if status["undelivered"] is not None:
+        COMMENT_STREAM_LAG.set(status["undelivered"])
+    COMMENT_STREAM_PENDING.set(status["pending"])
+    COMMENT_STREAM_LAG_SECONDS.set(status["lag_seconds"])
+
+async def _next_messages(consumer: str, own_pending: bool, claim: bool) -> tuple[list[tuple[str, dict]], bool]:
+    # (записи, взяты ли они из своих неподтверждённых - тогда следующей пачкой читаем их же)
+    if own_pending:
+        # после перезапуска с тем же именем или после ошибки
+        reply = await redis_client.xreadgroup(
+            COMMENTS_GROUP, consumer, {COMMENTS_STREAM: "0"}, count=COMMENTS_BATCH_SIZE,
+        )
+        if reply and reply[0][1]:
+            return reply[0][1], True
+    if claim:
+        # записи упавших воркеров
+        reply = await redis_client.xautoclaim(
+            COMMENTS_STREAM, COMMENTS_GROUP, consumer, COMMENTS_CLAIM_IDLE_MS, count=COMMENTS_BATCH_SIZE,
+        )
+        if reply[1]:
+            return reply[1], False
+    reply = await redis_client.xreadgroup(
+        COMMENTS_GROUP, consumer, {COMMENTS_STREAM: ">"}, count=COMMENTS_BATCH_SIZE, block=COMMENTS_BLOCK_MS,
+    )
+    return (reply[0][1] if reply else []), False
+
+async def _dead_letter_exhausted(messages: list[tuple[str, dict]]) -> int:
+    # Записи пачки, которую не удаётся записать уже COMMENTS_MAX_DELIVERIES раз, уходят в
+    # COMMENTS_DEAD_LETTER_STREAM, чтобы одна «ядовитая» пачка не останавливала поток навсегда
+    pipe = redis_client.pipeline(transaction=False)
+    for message_id, _ in messages:
+        pipe.xpending_range(COMMENTS_STREAM, COMMENTS_GROUP, min=message_id, max=message_id, count=1)
+    deliveries = {
+        entry["message_id"]: entry["times_delivered"]
+        for pending in await pipe.execute() for entry in pending
+    }
+    exhausted = [
+        (message_id, fields) for message_id, fields in messages
+        if deliveries.get(message_id, 0) >= COMMENTS_MAX_DELIVERIES
+    ]
+    if not exhausted:
+        return 0
+    pipe = redis_client.pipeline(transaction=False)
+    for message_id, fields in exhausted:
+        _dead_letter(pipe, message_id, fields, f"failed after {deliveries[message_id]} deliveries")
+    ids = [message_id for message_id, _ in exhausted]
+    pipe.xack(COMMENTS_STREAM, COMMENTS_GROUP, *ids)
+    pipe.xdel(COMMENTS_STREAM, *ids)
+    await pipe.execute()
+    COMMENTS_INGESTED.labels("rejected").inc(len(exhausted))
+    return len(exhausted)
+
+async def run(consumer: str):
+    await ensure_group()
+    logger.info("comment writer %s reading %s", consumer, COMMENTS_STREAM)
+    own_pending = True
+    next_claim = next_report = 0.0
+    while True:
+        now = time.monotonic()
+        claim = now >= next_claim
+        if claim:
+            next_claim = now + COMMENTS_CLAIM_IDLE_MS / 2000
+        messages = []
+        try:
+            if now >= next_report:
+                next_report = now + LAG_REPORT_INTERVAL
+                await _report_lag()
+            messages, own_pending = await _next_messages(consumer, own_pending, claim)
+            # записи, удалённые из потока до подтверждения, приходят без полей - их остаётся только подтвердить
+            gone = [message_id for message_id, fields in messages if not fields]
+            if gone:
+                await redis_client.xack(COMMENTS_STREAM, COMMENTS_GROUP, *gone)
+            messages = [(message_id, fields) for message_id, fields in messages if fields]
+            if messages:
+                await process(messages)
+        except Exception:
+            # БД или Redis недоступны: записи остаются неподтверждёнными и будут прочитаны снова
+            logger.exception("comment batch failed, retrying")
+            own_pending = True
+            if messages:
+                try:
+                    exhausted = await _dead_letter_exhausted(messages)
+                except Exception:
+                    logger.exception("moving exhausted comments to dead letter stream failed")
+                else:
+                    if exhausted:
+                        logger.warning(
+                            "%d comments moved to %s after %d deliveries",
+                            exhausted, COMMENTS_DEAD_LETTER_STREAM, COMMENTS_MAX_DELIVERIES,
+                        )
+            await asyncio.sleep(1)
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.db.comment_ingest", description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--consumer", default=f"{socket.gethostname()}-{os.getpid()}",
+        help="consumer name; keep it stable across restarts to resume own pending entries first",
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=int(os.getenv("COMMENTS_WORKER_METRICS_PORT", "9101")),
+        help="serve Prometheus metrics on this port, 0 to disable",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if args.metrics_port:
+        instrument_engine(async_engine.sync_engine)
+        instrument_redis(redis_client)
+        start_http_server(args.metrics_port)
+    asyncio.run(run(args.consumer))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import os
+import time
+import uuid
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.db import redis_client
+from app.models.comment import Comment
+
+# Отложенная запись комментариев (COMMENTS_WRITE_BEHIND=1): ручка кладёт комментарий в Redis Stream
+# и отвечает 202, в БД его пачками пишет воркер python -m app.db.comment_ingest.
+# Поток должен переживать перезапуск Redis - нужен AOF (appendonly yes), иначе принятые комментарии
+# могут пропасть вместе с ним.
+COMMENTS_WRITE_BEHIND = os.getenv("COMMENTS_WRITE_BEHIND", "0") == "1"
+COMMENTS_STREAM = os.getenv("COMMENTS_STREAM", "comments:ingest")
+COMMENTS_GROUP = os.getenv("COMMENTS_GROUP", "comment-writers")
+COMMENTS_DEAD_LETTER_STREAM = os.getenv("COMMENTS_DEAD_LETTER_STREAM", "comments:dead")
+COMMENTS_REJECTED_TTL = 86400
+
+def rejected_key(client_id: str) -> str:
+    return f"comment_rejected:{client_id}"
+
+async def enqueue_comment(news_id: int, author_id: int, text: str) -> dict:
+    # Время публикации фиксируется при приёме: по нему выбирается секция, и вместе с client_id
+    # оно делает повторную вставку той же записи безвредной
+    comment = {
+        "client_id": str(uuid.uuid4()),
+        "news_id": news_id,
+        "author_id": author_id,
+        "text": text,
+        "published_at": datetime.utcnow().isoformat(),
+    }
+    await redis_client.xadd(COMMENTS_STREAM, {k: str(v) for k, v in comment.items()})
+    return comment
+
+async def comment_status(client_id: uuid.UUID, db: AsyncSession) -> tuple[str, Comment | str | None]:
+    # ("stored", комментарий) | ("rejected", причина) | ("pending", None)
+    c = await db.scalar(select(Comment).where(Comment.client_id == client_id))
+    if c is not None:
+        return "stored", c
+    reason = await redis_client.get(rejected_key(str(client_id)))
+    if reason is not None:
+        return "rejected", reason
+    return "pending", None
+
+def _entry_age(entry_id: str | None) -> float:
+    # id записи потока начинается с времени добавления в миллисекундах
+    if not entry_id:
+        return 0.0
+    return max(time.time() - int(entry_id.split("-")[0]) / 1000, 0.0)
+
+async def stream_status() -> dict:
+    if not await redis_client.exists(COMMENTS_STREAM):
+        return {"stream": COMMENTS_STREAM, "group": None}
+    groups = await redis_client.xinfo_groups(COMMENTS_STREAM)
+    group = next((g for g in groups if g["name"] == COMMENTS_GROUP), None)
+    if group is None:
+        return {"stream": COMMENTS_STREAM, "group": None}
+    pending = await redis_client.xpending(COMMENTS_STREAM, COMMENTS_GROUP)
+    # самая старая незаписанная запись: первая из ожидающих подтверждения или первая ещё не выданная
+    oldest = pending["min"]
+    if oldest is None:
+        undelivered = await redis_client.xrange(COMMENTS_STREAM, f"({group['last-delivered-id']}", "+", count=1)
+        oldest = undelivered[0][0] if undelivered else None
+    return {
+        "stream": COMMENTS_STREAM,
+        "group": COMMENTS_GROUP,
+        "undelivered": group.get("lag"),  # есть с Redis 7
+        "pending": pending["pending"],
+        "lag_seconds": round(_entry_age(oldest), 3),
+        "dead_letters": await redis_client.xlen(COMMENTS_DEAD_LETTER_STREAM),
+    }
@@ -0,0 +1,5 @@
+from sqlalchemy.exc import IntegrityError
+
+def violated_constraint(e: IntegrityError) -> str | None:
+    # имя нарушенного ограничения: asyncpg кладёт его в исходное исключение, SQLAlchemy оборачивает его в e.orig
+    return getattr(e.orig.__cause__, "constraint_name", None) or getattr(e.orig, "constraint_name", None)
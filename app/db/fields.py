@@ -0,0 +1,63 @@
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+from fastapi import HTTPException
+from sqlalchemy.orm import load_only
+from app.cache.codecs import JSON
+from app.cache.conditional import item_modified
+from app.cache.redis_cache import cache_peek
+
+# Разреженные наборы полей: ?fields=id,title,cover_url. Запрошенные поля превращаются в load_only,
+# так что остальные колонки (прежде всего JSONB news.content) не читаются из БД вовсе.
+# Набор полей приводится к порядку модели, поэтому "title,id" и "id,title" - один и тот же набор
+# и один ключ кэша.
+
+def _dump(value: Any) -> Any:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class FieldSet:
+    def __init__(self, model, *names: str, required: tuple[str, ...] = ("id",)):
+        self.model = model
+        self.names = names  # все поля ответа в порядке вывода
+        self.required = required  # отдаются всегда, даже если не запрошены
+
+    def parse(self, fields: str | None) -> tuple[str, ...]:
+        if not fields:
+            return self.names
+        requested = {name.strip() for name in fields.split(",") if name.strip()}
+        unknown = requested - set(self.names)
+        if unknown:
+            raise HTTPException(400, f"Unknown fields: {', '.join(sorted(unknown))}")
+        return tuple(name for name in self.names if name in requested or name in self.required)
+
+    def is_full(self, names: tuple[str, ...]) -> bool:
+        return names == self.names
+
+    def cache_suffix(self, names: tuple[str, ...]) -> str:
+        # полный набор - прежний ключ, чтобы не терять уже заполненный кэш
+        return "" if self.is_full(names) else ":f=" + ",".join(names)
+
+    def load_only(self, names: tuple[str, ...], *extra):
+        # extra - колонки, нужные самому запросу (например, ключ курсора), но не ответу
+        return load_only(*(getattr(self.model, name) for name in names), *extra)
+
+    def dump(self, obj, names: tuple[str, ...] | None = None) -> dict:
+        return {name: _dump(getattr(obj, name)) for name in names or self.names}
+
+    def project(self, body: dict, names: tuple[str, ...]) -> dict:
+        return body if self.is_full(names) else {name: body[name] for name in names}
+
+async def cached_projection(
+    key: str, field_set: FieldSet, names: tuple[str, ...], load: Callable[[], Awaitable[Any]]
+) -> tuple[bytes, float] | None:
+    # Неполный объект по ключу полного (key): из свежей записи кэша, а при промахе - из БД только
+    # нужными колонками (load), без записи в кэш, чтобы под key всегда лежал полный объект.
+    # Вместе с JSON возвращается время изменения для Last-Modified (0 - неизвестно)
+    entry = await cache_peek(key)
+    if entry is not None:
+        value = entry.value()
+        return None if value is None else (JSON.dumps(field_set.project(value, names)), entry.modified)
+    obj = await load()
+    if obj is None:
+        return None
+    body = field_set.dump(obj, names)
+    return JSON.dumps(body), item_modified(body)
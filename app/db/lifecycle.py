@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import AsyncExitStack
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import configure_mappers
+from app.db.db import DB_PGBOUNCER, DB_POOL_SIZE, AsyncSessionLocal, async_engine, redis_bytes_client, redis_client
+from app.db.replicas import replicas
+from app.models.comment import Comment
+from app.models.news import News
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+# Прогрев при старте воркера (lifespan в app/main.py): первые запросы после деплоя или автомасштабирования
+# не платят за установку соединений, настройку мапперов и компиляцию SQL.
+# Ошибки прогрева не мешают старту: всё недостающее создастся по первому запросу, как и без прогрева.
+DB_WARMUP_CONNECTIONS = int(os.getenv("DB_WARMUP_CONNECTIONS", str(min(DB_POOL_SIZE, 4))))
+REDIS_WARMUP_CONNECTIONS = int(os.getenv("REDIS_WARMUP_CONNECTIONS", "4"))
+STARTUP_WARMUP_TIMEOUT = float(os.getenv("STARTUP_WARMUP_TIMEOUT", "10"))
+
+async def _open_db_connections(engine: AsyncEngine, count: int) -> int:
+    # Соединения держатся открытыми одновременно, иначе пул выдавал бы одно и то же;
+    # после выхода они остаются в пуле установленными
+    async def connect(stack: AsyncExitStack):
+        conn = await stack.enter_async_context(engine.connect())
+        await conn.execute(text("SELECT 1"))
+
+    async with AsyncExitStack() as stack:
+        results = await asyncio.gather(*(connect(stack) for _ in range(count)), return_exceptions=True)
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        raise errors[0]
+    return count
+
+async def _open_redis_connections(count: int) -> int:
+    # одновременные PING занимают разные соединения пула
+    for client in (redis_client, redis_bytes_client):
+        await asyncio.gather(*(client.ping() for _ in range(count)))
+    return count
+
+async def _prime_statements():
+    # Кэш скомпилированных выражений движка заполняется при первом выполнении каждой формы запроса:
+    # выполняем самые частые (чтение по первичному ключу) на заведомо отсутствующих id
+    async with AsyncSessionLocal() as db:
+        for model in (News, User, Comment):
+            await db.get(model, 0)
+
+async def _warm_up() -> dict:
+    result = {}
+    # с PgBouncer (NullPool) соединения не переиспользуются, а сверх DB_POOL_SIZE не задерживаются в пуле
+    db_connections = 0 if DB_PGBOUNCER else min(DB_WARMUP_CONNECTIONS, DB_POOL_SIZE)
+    if db_connections > 0:
+        result["db_connections"] = await _open_db_connections(async_engine, db_connections)
+        for replica in replicas:
+            await _open_db_connections(replica.engine, db_connections)
+    if REDIS_WARMUP_CONNECTIONS > 0:
+        result["redis_connections"] = await _open_redis_connections(REDIS_WARMUP_CONNECTIONS)
+    await _prime_statements()
+    return result
+
+async def warm_up() -> dict:
+    start = time.perf_counter()
+    # настройка мапперов не требует сети и выполняется всегда
+    configure_mappers()
+    try:
+        result = await asyncio.wait_for(_warm_up(), STARTUP_WARMUP_TIMEOUT)
+    except Exception as e:
+        logger.warning("startup warm-up incomplete: %r", e)
+        result = {"error": repr(e)}
+    result["ms"] = round((time.perf_counter() - start) * 1000, 1)
+    logger.info("startup warm-up: %s", result)
+    return result
+
+async def close_connections():
+    # Пулы закрываются при остановке воркера, чтобы Postgres и Redis не ждали обрыва по таймауту
+    await async_engine.dispose()
+    for replica in replicas:
+        await replica.engine.dispose()
+    for client in (redis_client, redis_bytes_client):
+        await client.aclose()
@@ -0,0 +1,37 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Callable, Sequence
+from fastapi import HTTPException
+
+# Курсор - непрозрачная для клиента строка: base64url от json-массива значений ключа сортировки.
+
+def encode_cursor(*values: Any) -> str:
+    raw = json.dumps(
+        [v.isoformat() if isinstance(v, datetime) else v for v in values],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types: type) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        return tuple(
+            datetime.fromisoformat(v) if t is datetime else t(v)
+            for t, v in zip(types, values)
+        )
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(400, "Invalid cursor")
+
+def make_page(rows: Sequence, limit: int, to_dict: Callable, cursor_of: Callable) -> dict:
+    # rows выбираются с limit + 1: лишняя строка означает, что есть следующая страница
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [to_dict(r) for r in rows],
+        "next_cursor": encode_cursor(*cursor_of(rows[-1])) if has_more else None,
+    }
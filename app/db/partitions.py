@@ -0,0 +1,218 @@
+"""Помесячные секции таблицы comments: создание, хранение и архивирование.
+
+    python -m app.db.partitions list
+    python -m app.db.partitions maintain
+    python -m app.db.partitions archive --keep-months 24
+    python -m app.db.partitions archive --keep-months 24 --export-dir /mnt/archive
+
+maintain заводит секции на COMMENTS_PARTITIONS_AHEAD месяцев вперёд (запускать по расписанию, например раз в сутки).
+archive отсоединяет секции, целиком вышедшие за --keep-months: без --export-dir секция переносится в схему
+COMMENTS_ARCHIVE_SCHEMA (и в табличное пространство COMMENTS_ARCHIVE_TABLESPACE, если задано), с --export-dir
+выгружается в сжатый CSV и удаляется. Счётчики комментариев у новостей и пользователей уменьшаются на число
+архивированных строк.
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+from app.db.db import engine
+
+PARENT = "comments"
+DEFAULT_PARTITION = f"{PARENT}_default"
+
+COMMENTS_PARTITIONS_AHEAD = int(os.getenv("COMMENTS_PARTITIONS_AHEAD", "3"))
+COMMENTS_ARCHIVE_SCHEMA = os.getenv("COMMENTS_ARCHIVE_SCHEMA", "archive")
+COMMENTS_ARCHIVE_TABLESPACE = os.getenv("COMMENTS_ARCHIVE_TABLESPACE", "")
+# DETACH берёт эксклюзивную блокировку на comments: лучше не дождаться её и повторить позже,
+# чем выстроить за долгим запросом очередь из всех обращений к комментариям
+PARTITION_LOCK_TIMEOUT = os.getenv("PARTITION_LOCK_TIMEOUT", "5s")
+
+BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+def add_months(month: datetime, n: int) -> datetime:
+    years, month_index = divmod(month.month - 1 + n, 12)
+    return datetime(month.year + years, month_index + 1, 1)
+
+def partition_name(month: datetime) -> str:
+    return f"{PARENT}_p{month:%Y_%m}"
+
+def list_partitions(cur) -> list[dict]:
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+    """, (PARENT,))
+    partitions = []
+    for name, bound, rows in cur.fetchall():
+        match = BOUND_RE.search(bound)
+        partitions.append({
+            "name": name,
+            "from": datetime.fromisoformat(match.group(1)) if match else None,
+            "to": datetime.fromisoformat(match.group(2)) if match else None,
+            "rows": max(rows, 0),  # оценка планировщика, -1 до первого ANALYZE
+        })
+    return partitions
+
+def create_partition(cur, month: datetime):
+    name = partition_name(month)
+    lower, upper = f"{month:%Y-%m-%d}", f"{add_months(month, 1):%Y-%m-%d}"
+    cur.execute(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE published_at >= %s AND published_at < %s)",
+        (lower, upper),
+    )
+    if not cur.fetchone()[0]:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF {PARENT} FOR VALUES FROM (%s) TO (%s)", (lower, upper))
+        return
+    # Строки месяца уже лежат в секции по умолчанию, и PostgreSQL не даст создать поверх неё секцию.
+    # Переносим их в отдельную таблицу и подключаем её: пока таблица не подключена, на ней нет триггеров,
+    # так что счётчики не меняются
+    cur.execute("SET LOCAL lock_timeout = %s", (PARTITION_LOCK_TIMEOUT,))
+    cur.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {DEFAULT_PARTITION}")
+    cur.execute(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION} WHERE published_at >= %s AND published_at < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """, (lower, upper))
+    cur.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (lower, upper))
+    cur.execute(f"ALTER TABLE {PARENT} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT")
+
+def ensure_partitions(cur, start: datetime, end: datetime) -> list[str]:
+    # Секции на каждый месяц от start до end включительно
+    existing = {p["name"] for p in list_partitions(cur)}
+    created = []
+    month = month_start(start)
+    while month <= end:
+        if partition_name(month) not in existing:
+            create_partition(cur, month)
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+def maintain() -> dict:
+    now = datetime.utcnow()
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        # заодно разбираем секцию по умолчанию: загрузка задним числом могла положить туда строки
+        cur.execute(f"SELECT min(published_at) FROM {DEFAULT_PARTITION}")
+        oldest = cur.fetchone()[0]
+        start = min(oldest, now) if oldest else now
+        created = ensure_partitions(cur, start, add_months(month_start(now), COMMENTS_PARTITIONS_AHEAD))
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    return {"created": created}
+
+def _detach(raw, name: str) -> int:
+    cur = raw.cursor()
+    try:
+        cur.execute("SET LOCAL lock_timeout = %s", (PARTITION_LOCK_TIMEOUT,))
+        # запись в секцию останавливается, чтение из comments - нет
+        cur.execute(f"LOCK TABLE {name} IN SHARE MODE")
+        cur.execute(f"SELECT count(*) FROM {name}")
+        rows = cur.fetchone()[0]
+        # счётчики ведут триггеры, а отсоединение секции их не вызывает
+        cur.execute(f"""
+            UPDATE news n SET comments_count = n.comments_count - c.cnt
+            FROM (SELECT news_id, count(*) AS cnt FROM {name} GROUP BY news_id) c
+            WHERE c.news_id = n.id
+        """)
+        cur.execute(f"""
+            UPDATE users u SET comments_count = u.comments_count - c.cnt
+            FROM (SELECT author_id, count(*) AS cnt FROM {name} GROUP BY author_id) c
+            WHERE c.author_id = u.id
+        """)
+        cur.execute(f"ALTER TABLE {PARENT} DETACH PARTITION {name}")
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    return rows
+
+def _move_to_archive(raw, name: str) -> str:
+    # Отсоединённая таблица больше не участвует в запросах, её перенос блокирует только её саму
+    cur = raw.cursor()
+    cur.execute(f"CREATE SCHEMA IF NOT EXISTS {COMMENTS_ARCHIVE_SCHEMA}")
+    cur.execute(f"ALTER TABLE {name} SET SCHEMA {COMMENTS_ARCHIVE_SCHEMA}")
+    if COMMENTS_ARCHIVE_TABLESPACE:
+        cur.execute(f"ALTER TABLE {COMMENTS_ARCHIVE_SCHEMA}.{name} SET TABLESPACE {COMMENTS_ARCHIVE_TABLESPACE}")
+        cur.execute(
+            "SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = %s::regclass",
+            (f"{COMMENTS_ARCHIVE_SCHEMA}.{name}",),
+        )
+        for (index,) in cur.fetchall():
+            cur.execute(f"ALTER INDEX {index} SET TABLESPACE {COMMENTS_ARCHIVE_TABLESPACE}")
+    raw.commit()
+    return f"{COMMENTS_ARCHIVE_SCHEMA}.{name}"
+
+def _export_and_drop(raw, name: str, export_dir: str) -> str:
+    path = os.path.join(export_dir, f"{name}.csv.gz")
+    cur = raw.cursor()
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as dst:
+        cur.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER true)", dst, size=1 << 16)
+    cur.execute(f"DROP TABLE {name}")
+    raw.commit()
+    return path
+
+def archive(keep_months: int, export_dir: str | None = None) -> dict:
+    # Архивируются только секции, целиком лежащие раньше первого месяца окна хранения
+    cutoff = add_months(month_start(datetime.utcnow()), -keep_months)
+    archived = []
+    raw = engine.raw_connection()
+    try:
+        partitions = list_partitions(raw.cursor())
+        raw.rollback()
+        for p in partitions:
+            if p["to"] is None or p["to"] > cutoff:
+                continue
+            rows = _detach(raw, p["name"])
+            try:
+                if export_dir:
+                    target = _export_and_drop(raw, p["name"], export_dir)
+                else:
+                    target = _move_to_archive(raw, p["name"])
+            except Exception:
+                raw.rollback()
+                raise
+            archived.append({"partition": p["name"], "rows": rows, "target": target})
+    finally:
+        raw.close()
+    return {"cutoff": cutoff.isoformat(), "archived": archived}
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.db.partitions", description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="show comment partitions")
+    sub.add_parser("maintain", help=f"create partitions {COMMENTS_PARTITIONS_AHEAD} months ahead")
+    p_archive = sub.add_parser("archive", help="detach partitions older than the retention window")
+    p_archive.add_argument("--keep-months", type=int, required=True, help="months of comments to keep online")
+    p_archive.add_argument("--export-dir", help="dump detached partitions to gzipped CSV here and drop them")
+
+    args = parser.parse_args(argv)
+    if args.command == "list":
+        raw = engine.raw_connection()
+        try:
+            result = list_partitions(raw.cursor())
+        finally:
+            raw.close()
+    elif args.command == "maintain":
+        result = maintain()
+    else:
+        if args.keep_months < 1:
+            parser.error("--keep-months must be at least 1")
+        result = archive(args.keep_months, args.export_dir)
+    print(json.dumps(result, default=str))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import logging
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Профилирование SQL для разработки и стенда (SQL_PROFILE=1), в проде выключено:
+# - каждый запрос к БД привязывается к маршруту текущего HTTP-запроса;
+# - запросы дольше SQL_SLOW_MS пишутся в лог вместе с планом EXPLAIN;
+# - одинаковый по форме запрос, повторённый SQL_N_PLUS_ONE раз за один HTTP-запрос, помечается как N+1;
+# - обработчик может объявить бюджет запросов (@sql_budget); при SQL_BUDGET_STRICT=1 превышение - исключение,
+#   так что тесты падают, а не пишут предупреждение.
+
+SQL_PROFILE = os.getenv("SQL_PROFILE", "0") == "1"
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "100"))
+SQL_EXPLAIN = os.getenv("SQL_EXPLAIN", "1") == "1"
+SQL_N_PLUS_ONE = int(os.getenv("SQL_N_PLUS_ONE", "3"))
+SQL_BUDGET_STRICT = os.getenv("SQL_BUDGET_STRICT", "0") == "1"
+
+logger = logging.getLogger("app.sql")
+
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+class SQLBudgetExceeded(RuntimeError):
+    pass
+
+def sql_budget(max_queries: int):
+    # Бюджет запросов обработчика; проверяется только при SQL_PROFILE=1
+    def decorator(endpoint):
+        endpoint.__sql_budget__ = max_queries
+        return endpoint
+    return decorator
+
+@dataclass
+class RequestProfile:
+    scope: dict
+    queries: int = 0
+    duration: float = 0.0
+    shapes: Counter = field(default_factory=Counter)
+    reported: set = field(default_factory=set)
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        return getattr(route, "path", self.scope.get("path", "?"))
+
+    @property
+    def budget(self) -> int | None:
+        route = self.scope.get("route")
+        return getattr(getattr(route, "endpoint", None), "__sql_budget__", None)
+
+_profile: ContextVar[RequestProfile | None] = ContextVar("sql_profile", default=None)
+
+def _explain(conn, statement: str, parameters) -> str:
+    # Отдельный курсор в той же транзакции, под savepoint: ошибка EXPLAIN не должна ломать запрос
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT sql_profile_explain")
+        try:
+            cursor.execute("EXPLAIN " + statement, parameters)
+            plan = "\n".join(str(row[0]) for row in cursor.fetchall())
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT sql_profile_explain")
+            plan = f"EXPLAIN failed: {e}"
+        cursor.execute("RELEASE SAVEPOINT sql_profile_explain")
+        return plan
+    finally:
+        cursor.close()
+
+def install_profiling(engine: Engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._profile_start = time.perf_counter()
+        profile = _profile.get()
+        if profile is None:
+            return
+        profile.queries += 1
+        budget = profile.budget
+        if SQL_BUDGET_STRICT and budget is not None and profile.queries > budget:
+            raise SQLBudgetExceeded(f"{profile.route}: more than {budget} SQL queries")
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._profile_start
+        profile = _profile.get()
+        route = profile.route if profile else "-"
+        if profile is not None:
+            profile.duration += elapsed
+            # форма запроса - сам текст: параметры в нём плейсхолдеры, значения не входят
+            profile.shapes[statement] += 1
+            if profile.shapes[statement] == SQL_N_PLUS_ONE and statement not in profile.reported:
+                profile.reported.add(statement)
+                logger.warning("possible N+1 in %s: statement repeated %d times: %s", route, SQL_N_PLUS_ONE, statement)
+
+        if elapsed * 1000 < SQL_SLOW_MS:
+            return
+        plan = ""
+        if SQL_EXPLAIN and not executemany and statement.split(None, 1)[0].upper() in EXPLAINABLE:
+            plan = "\n" + _explain(conn, statement, parameters)
+        logger.warning("slow query in %s: %.1f ms: %s%s", route, elapsed * 1000, statement, plan)
+
+class SQLProfileMiddleware:
+    # Заводит профиль на каждый HTTP-запрос и пишет итог: число запросов, время в БД, превышение бюджета
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile = RequestProfile(scope)
+        token = _profile.set(profile)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _profile.reset(token)
+            budget = profile.budget
+            if budget is not None and profile.queries > budget:
+                logger.warning("%s %s: %d SQL queries, budget %d", scope["method"], profile.route, profile.queries, budget)
+            elif profile.queries:
+                logger.debug(
+                    "%s %s: %d SQL queries, %.1f ms", scope["method"], profile.route, profile.queries, profile.duration * 1000,
+                )
@@ -0,0 +1,116 @@
+import asyncio
+import itertools
+import logging
+import os
+from fastapi import Depends
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from app.auth.deps import Principal, get_optional_user
+from app.db.db import (
+    AsyncSessionLocal, DATABASE_REPLICA_URLS, async_engine_options, primary_pin_key, redis_client,
+)
+from app.db.profiling import SQL_PROFILE, install_profiling
+from app.metrics import REPLICA_LAG, REPLICA_UP
+
+logger = logging.getLogger(__name__)
+
+# Реплика выводится из ротации, если отстаёт больше DB_REPLICA_MAX_LAG секунд или не отвечает;
+# состояние проверяется каждые DB_REPLICA_CHECK_INTERVAL секунд фоновой задачей (см. lifespan в app/main.py).
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "2"))
+
+# Отставание по времени последней применённой транзакции. Если всё полученное уже применено и WAL receiver
+# в статусе streaming, реплика догнала primary (на простаивающей базе время последней транзакции было бы давним).
+# После обрыва репликации полученное тоже применено целиком, поэтому без streaming такая проверка не годится:
+# другой статус receiver - реплика неисправна. Статус виден только ролям с pg_read_all_stats (pg_monitor),
+# для остальных он NULL (или строки нет) - тогда отставание считается только по времени последней транзакции.
+LAG_SQL = text("""
+    SELECT
+        pg_is_in_recovery() AS in_recovery,
+        (SELECT status FROM pg_stat_wal_receiver LIMIT 1) AS receiver,
+        pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() AS caught_up,
+        coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) AS replay_age
+""")
+
+class Replica:
+    def __init__(self, url: str):
+        self.engine = create_async_engine(**async_engine_options(url.replace("+psycopg2", "+asyncpg")))
+        parsed = make_url(url)
+        # имя для логов и метрик - без пароля
+        self.name = f"{parsed.host}:{parsed.port or 5432}/{parsed.database}"
+        self.healthy = False
+        self.checked = False  # первая проверка логируется в любом случае
+        self.lag: float | None = None
+
+    async def _probe(self):
+        async with self.engine.connect() as conn:
+            return (await conn.execute(LAG_SQL)).one()
+
+    async def check(self):
+        try:
+            probe = await asyncio.wait_for(self._probe(), DB_REPLICA_CHECK_INTERVAL)
+        except Exception as e:
+            self._set_state(False, None, f"unreachable: {e}")
+            return
+        if not probe.in_recovery:
+            self._set_state(True, 0.0, "not in recovery")
+            return
+        lag = float(probe.replay_age)
+        if probe.receiver is None:
+            # статус не виден этой роли: обрыв не отличить от простоя, остаётся время последней транзакции
+            self._set_state(lag <= DB_REPLICA_MAX_LAG, lag, f"lag {lag:.1f}s, WAL receiver status unavailable")
+            return
+        if probe.receiver != "streaming":
+            self._set_state(False, lag, f"WAL receiver is {probe.receiver}")
+            return
+        lag = 0.0 if probe.caught_up else lag
+        self._set_state(lag <= DB_REPLICA_MAX_LAG, lag, f"lag {lag:.1f}s")
+
+    def _set_state(self, healthy: bool, lag: float | None, reason: str):
+        if not self.checked:
+            log = logger.info if healthy else logger.warning
+            log("replica %s %s rotation: %s", self.name, "in" if healthy else "out of", reason)
+        elif healthy != self.healthy:
+            logger.warning("replica %s %s rotation: %s", self.name, "back in" if healthy else "out of", reason)
+        self.checked = True
+        self.healthy = healthy
+        self.lag = lag
+        REPLICA_UP.labels(self.name).set(1 if healthy else 0)
+        if lag is not None:
+            REPLICA_LAG.labels(self.name).set(lag)
+
+replicas = [Replica(url) for url in DATABASE_REPLICA_URLS]
+if SQL_PROFILE:
+    for replica in replicas:
+        install_profiling(replica.engine.sync_engine)
+_round_robin = itertools.count()
+
+def pick_replica() -> AsyncEngine | None:
+    healthy = [replica for replica in replicas if replica.healthy]
+    if not healthy:
+        return None
+    return healthy[next(_round_robin) % len(healthy)].engine
+
+async def _monitor_replicas():
+    while True:
+        await asyncio.gather(*(replica.check() for replica in replicas))
+        await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
+
+def start_replica_monitor() -> asyncio.Task | None:
+    if not replicas:
+        return None
+    return asyncio.create_task(_monitor_replicas())
+
+# Сессия для обработчиков, которые только читают и не наполняют общий кэш (иначе отстающая реплика
+# положила бы в кэш старую строку сразу после инвалидации). Без реплик, без исправных реплик
+# и в течение DB_PRIMARY_PIN_SECONDS после записи пользователя - primary.
+async def get_read_db(user: Principal | None = Depends(get_optional_user)):
+    bind = pick_replica()
+    if bind is not None and user is not None and await redis_client.exists(primary_pin_key(user.id)):
+        bind = None
+    async with (AsyncSessionLocal(bind=bind) if bind is not None else AsyncSessionLocal()) as db:
+        yield db
+
+def replicas_status() -> list[dict]:
+    return [{"name": replica.name, "healthy": replica.healthy, "lag": replica.lag} for replica in replicas]
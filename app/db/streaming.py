@@ -0,0 +1,29 @@
+import json
+from typing import Callable
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncEngine
+from app.db.db import AsyncSessionLocal
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Сколько строк за раз забирается из серверного курсора и пишется в ответ одним куском
+STREAM_BATCH_SIZE = 500
+
+def wants_ndjson(request: Request, stream: bool) -> bool:
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def ndjson_response(stmt: Select, to_dict: Callable, bind: AsyncEngine | None = None) -> StreamingResponse:
+    # Своя сессия: генератор живёт дольше запроса, а stream() с yield_per читает
+    # строки серверным курсором, так что память не зависит от размера таблицы.
+    # bind - движок сессии обработчика, чтобы выгрузка шла с той же реплики.
+    async def rows():
+        async with (AsyncSessionLocal(bind=bind) if bind is not None else AsyncSessionLocal()) as db:
+            result = await db.stream_scalars(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+            async for batch in result.partitions():
+                yield "".join(
+                    json.dumps(to_dict(obj), ensure_ascii=False, default=str) + "\n"
+                    for obj in batch
+                )
+
+    return StreamingResponse(rows(), media_type=NDJSON_MEDIA_TYPE)
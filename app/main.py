@@ -1,15 +1,81 @@
 from dotenv import load_dotenv
 load_dotenv()
 
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.routers.user_router import router as users_router
-from app.routers.news_router import router as news_router
-from app.routers.comment_router import router as comments_router
-from app.routers.auth_router import router as auth_router
+from app.cache.redis_cache import start_invalidation_listener
+from app.cache.trending import flush_views, start_trending_maintenance
+from app.db.db import async_engine, redis_bytes_client, redis_client
+from app.db.lifecycle import close_connections, warm_up
+from app.db.pool import pool_stats
+from app.db.replicas import replicas, start_replica_monitor
+from app.db.profiling import SQL_PROFILE, SQLProfileMiddleware
+from app.metrics import MetricsMiddleware, instrument_engine, instrument_redis, register_pool_collector
 
-app = FastAPI(title="Новости")
+logger = logging.getLogger(__name__)
 
-app.include_router(users_router)
-app.include_router(news_router)
-app.include_router(comments_router)
-app.include_router(auth_router)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # воркер начинает принимать запросы с открытыми соединениями и прогретыми кэшами SQLAlchemy
+    await warm_up()
+    tasks = [
+        task for task in (start_invalidation_listener(), start_replica_monitor(), start_trending_maintenance())
+        if task
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # накопленные просмотры иначе пропали бы вместе с процессом
+    try:
+        await flush_views()
+    except Exception:
+        logger.exception("trending views flush failed on shutdown")
+    await close_connections()
+
+_instrumented = False
+
+def _instrument():
+    # Метрики SQL, Redis и пула собираются только в процессе приложения, консольные скрипты их не пишут.
+    # Обработчики вешаются на общие движки и клиенты один раз, сколько бы приложений ни создавалось.
+    global _instrumented
+    if _instrumented:
+        return
+    instrument_engine(async_engine.sync_engine)
+    for replica in replicas:
+        instrument_engine(replica.engine.sync_engine)
+    instrument_redis(redis_client)
+    instrument_redis(redis_bytes_client)
+    register_pool_collector(async_engine, pool_stats)
+    _instrumented = True
+
+def create_app() -> FastAPI:
+    # Роутеры импортируются здесь: импорт app.main (alembic, консольные скрипты) не собирает приложение
+    from app.routers.user_router import router as users_router
+    from app.routers.news_router import router as news_router
+    from app.routers.comment_router import router as comments_router
+    from app.routers.auth_router import router as auth_router
+    from app.routers.internal_router import metrics_router, router as internal_router
+
+    app = FastAPI(title="Новости", lifespan=lifespan)
+    app.add_middleware(MetricsMiddleware)
+    if SQL_PROFILE:
+        app.add_middleware(SQLProfileMiddleware)
+    _instrument()
+
+    app.include_router(users_router)
+    app.include_router(news_router)
+    app.include_router(comments_router)
+    app.include_router(auth_router)
+    app.include_router(internal_router)
+    app.include_router(metrics_router)
+    return app
+
+def __getattr__(name: str):
+    # uvicorn app.main:app и from app.main import app: приложение создаётся при первом обращении
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,157 @@
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+# Метрики Prometheus одного процесса: каждый воркер uvicorn отдаёт свои на /metrics.
+# Метки только с ограниченным набором значений: шаблон маршрута, тип SQL-оператора, имя команды Redis,
+# префикс ключа кэша - иначе число временных рядов растёт вместе с id в URL и ключах.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency, including streamed bodies",
+    ["method", "route"], buckets=LATENCY_BUCKETS,
+)
+SQL_LATENCY = Histogram(
+    "db_statement_duration_seconds", "SQL statement execution time", ["operation"], buckets=FAST_BUCKETS,
+)
+SQL_ERRORS = Counter("db_statement_errors_total", "Failed SQL statements", ["operation"])
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds", "Time to get a connection from the pool", buckets=FAST_BUCKETS,
+)
+REPLICA_LAG = Gauge("db_replica_lag_seconds", "Replication lag of a read replica", ["replica"])
+REPLICA_UP = Gauge("db_replica_in_rotation", "1 if the read replica receives queries", ["replica"])
+REDIS_LATENCY = Histogram(
+    "redis_command_duration_seconds", "Redis round trip time, a pipeline counts as one", ["command"],
+    buckets=FAST_BUCKETS,
+)
+REDIS_ERRORS = Counter("redis_command_errors_total", "Failed Redis round trips", ["command"])
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache operations by key prefix and result (hit, miss, stale, ok, error)",
+    ["op", "prefix", "result"],
+)
+COMMENTS_INGESTED = Counter(
+    "comments_ingested_total", "Comments taken from the write-behind stream (inserted, duplicate, rejected)", ["result"],
+)
+COMMENT_INGEST_BATCH = Histogram(
+    "comment_ingest_batch_seconds", "Time to write and acknowledge one batch of streamed comments",
+    buckets=LATENCY_BUCKETS,
+)
+COMMENT_STREAM_LAG = Gauge("comment_stream_lag_entries", "Stream entries not yet delivered to the writer group")
+COMMENT_STREAM_PENDING = Gauge("comment_stream_pending_entries", "Delivered stream entries not yet written")
+COMMENT_STREAM_LAG_SECONDS = Gauge("comment_stream_lag_seconds", "Age of the oldest comment not yet written")
+SSE_CLIENTS = Gauge("sse_clients", "Connected comment event stream clients")
+PASSWORD_HASH_LATENCY = Histogram(
+    "password_hash_duration_seconds", "Argon2 hashing time in the worker thread", ["op"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+PASSWORD_HASH_REJECTED = Counter("password_hash_rejected_total", "Hashing requests rejected with 503")
+
+def key_prefix(key: str) -> str:
+    return key.split(":", 1)[0]
+
+class MetricsMiddleware:
+    # Чистый ASGI-middleware: без BaseHTTPMiddleware и лишних задач на каждый запрос
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # маршрут известен после роутинга: FastAPI кладёт его в scope
+            route = scope.get("route")
+            path = getattr(route, "path", "<unmatched>")
+            HTTP_LATENCY.labels(scope["method"], path).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(scope["method"], path, str(status)).inc()
+
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "COPY"}
+
+def _operation(statement: str) -> str:
+    word = statement.split(None, 1)[0].upper() if statement.strip() else ""
+    return word if word in SQL_OPERATIONS else "OTHER"
+
+def instrument_engine(engine: Engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        SQL_LATENCY.labels(_operation(statement)).observe(time.perf_counter() - context._metrics_start)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        SQL_ERRORS.labels(_operation(exception_context.statement or "")).inc()
+
+def instrument_redis(client):
+    # У redis-py нет хуков: оборачиваем отправку команд и выполнение пайплайнов конкретного клиента
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    async def timed(command: str, call, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await call(*args, **kwargs)
+        except Exception:
+            REDIS_ERRORS.labels(command).inc()
+            raise
+        finally:
+            REDIS_LATENCY.labels(command).observe(time.perf_counter() - start)
+
+    async def timed_execute_command(*args, **options):
+        return await timed(str(args[0]).upper(), execute_command, *args, **options)
+
+    def timed_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def timed_execute(*a, **kw):
+            return await timed("PIPELINE", execute, *a, **kw)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    client.execute_command = timed_execute_command
+    client.pipeline = timed_pipeline
+
+class PoolCollector:
+    # Состояние пула читается в момент сбора метрик, без затрат на каждый запрос
+    def __init__(self, engine, stats):
+        self.engine = engine
+        self.stats = stats
+
+    def collect(self):
+        pool = self.engine.pool
+        if isinstance(pool, QueuePool):
+            for name, value, doc in (
+                ("db_pool_size", pool.size(), "Configured pool size"),
+                ("db_pool_checked_out", pool.checkedout(), "Connections in use"),
+                ("db_pool_checked_in", pool.checkedin(), "Idle connections in the pool"),
+                ("db_pool_overflow", max(pool.overflow(), 0), "Connections above pool_size"),
+            ):
+                yield GaugeMetricFamily(name, doc, value=value)
+        yield CounterMetricFamily("db_pool_timeouts", "Pool checkout timeouts", value=self.stats.timeouts)
+
+def register_pool_collector(engine, stats):
+    REGISTRY.register(PoolCollector(engine, stats))
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
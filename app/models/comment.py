@@ -1,17 +1,37 @@
 from app.models import Base
 from datetime import datetime
+from uuid import UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import Integer, DateTime, ForeignKey, Text
+from sqlalchemy import Integer, DateTime, ForeignKey, Text, Index, FetchedValue, Uuid, text as sql_text
+from app.db.fields import FieldSet
 
 class Comment(Base):
     __tablename__ = "comments"
+    __table_args__ = (
+        # keyset-пагинация комментариев новости: WHERE news_id = ? ORDER BY published_at, id
+        Index("ix_comments_news_id_published_at_id", "news_id", "published_at", "id"),
+        # повторная доставка из потока отложенной записи не создаёт дубль, см. app/db/comment_ingest.py
+        Index("uq_comments_client_id_published_at", "client_id", "published_at", unique=True),
+        # помесячные секции по published_at, см. миграцию 8a41f2c7d9b3 и app/db/partitions.py
+        {"postgresql_partition_by": "RANGE (published_at)"},
+    )
 
-    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    # первичный ключ в БД - (id, published_at), как требует секционирование; для ORM комментарий по-прежнему
+    # определяется одним id, так что db.get(Comment, id) работает без изменений
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     text: Mapped[str] = mapped_column(Text, nullable=False)
-    published_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+    published_at: Mapped[datetime] = mapped_column(DateTime, primary_key=True, default=datetime.utcnow)
+    # ставится триггером при любом UPDATE (API, триггеры счётчиков, COPY-загрузка), см. миграцию 3d5c0b6a91e2
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, default=datetime.utcnow,
+        server_default=sql_text("(now() at time zone 'utc')"), server_onupdate=FetchedValue()
+    )
+
+    # id, выданный клиенту при отложенной записи; у комментариев, созданных напрямую, пустой
+    client_id: Mapped[UUID | None] = mapped_column(Uuid, nullable=True)
 
     news_id: Mapped[int] = mapped_column(
-        ForeignKey("news.id", ondelete="CASCADE"), nullable=False, index=True
+        ForeignKey("news.id", ondelete="CASCADE"), nullable=False
     )
     author_id: Mapped[int] = mapped_column(
         ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True
@@ -19,3 +39,13 @@ class Comment(Base):
 
     news: Mapped["News"] = relationship(back_populates="comments")
     author: Mapped["User"] = relationship(back_populates="comments")
+
+    # новое updated_at возвращается из UPDATE ... RETURNING
+    __mapper_args__ = {"eager_defaults": True, "primary_key": [id]}
+
+# Поля комментария в ответах API и событиях comment.*; здесь, а не в роутере, потому что те же события
+# публикует воркер отложенной записи
+COMMENT_FIELDS = FieldSet(Comment, "id", "text", "published_at", "updated_at", "news_id", "author_id")
+
+def comment_to_dict(c: Comment, fields: tuple[str, ...] = COMMENT_FIELDS.names) -> dict:
+    return COMMENT_FIELDS.dump(c, fields)
@@ -1,18 +1,37 @@
 from datetime import datetime
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, Integer, DateTime, ForeignKey
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import String, Integer, DateTime, ForeignKey, Index, Computed, FetchedValue, text
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from app.models import Base
 
+# Конфигурация полнотекстового поиска и выражение для search_vector (см. миграцию 199f207f036c)
+SEARCH_CONFIG = "russian"
+SEARCH_VECTOR = (
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(title, '')), 'A') || "
+    f"setweight(jsonb_to_tsvector('{SEARCH_CONFIG}', content, '[\"string\"]'), 'B')"
+)
 
 class News(Base):
     __tablename__ = "news"
+    # новое updated_at возвращается из UPDATE ... RETURNING
+    __mapper_args__ = {"eager_defaults": True}
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     title: Mapped[str] = mapped_column(String(255), nullable=False)
     content: Mapped[dict] = mapped_column(JSONB, nullable=False)  # JSONB под Postgres
     published_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
     cover_url: Mapped[str | None] = mapped_column(String(512), nullable=True)
+    # ставится триггером при любом UPDATE (API, триггеры счётчиков, COPY-загрузка), см. миграцию 3d5c0b6a91e2
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, default=datetime.utcnow,
+        server_default=text("(now() at time zone 'utc')"), server_onupdate=FetchedValue()
+    )
+    # ведётся триггером на comments, см. миграцию 14c762fca798
+    comments_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default=text("0"))
+    # вычисляется Postgres из title и строк content; в обычных запросах не читается
+    search_vector: Mapped[str | None] = mapped_column(
+        TSVECTOR, Computed(SEARCH_VECTOR, persisted=True), deferred=True
+    )
 
     author_id: Mapped[int] = mapped_column(
         ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True
@@ -24,3 +43,8 @@ class News(Base):
         cascade="all, delete-orphan",
         passive_deletes=True
     )
+
+
+# Индекс под keyset-пагинацию ленты: ORDER BY published_at DESC, id DESC
+Index("ix_news_published_at_id", News.published_at.desc(), News.id.desc())
+Index("ix_news_search_vector", News.search_vector, postgresql_using="gin")
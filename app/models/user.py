@@ -1,12 +1,14 @@
 from datetime import datetime
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, Integer, DateTime, Boolean
+from sqlalchemy import String, Integer, DateTime, Boolean, FetchedValue, text
 
 from app.models import Base
 
 
 class User(Base):
     __tablename__ = "users"
+    # новое updated_at возвращается из UPDATE ... RETURNING
+    __mapper_args__ = {"eager_defaults": True}
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(100), nullable=False)
@@ -16,6 +18,14 @@ class User(Base):
     is_admin: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
     is_verified_author: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False)
     avatar_url: Mapped[str | None] = mapped_column(String(512), nullable=True)
+    # ставится триггером при любом UPDATE (API, триггеры счётчиков, COPY-загрузка), см. миграцию 3d5c0b6a91e2
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, default=datetime.utcnow,
+        server_default=text("(now() at time zone 'utc')"), server_onupdate=FetchedValue()
+    )
+    # ведутся триггерами на news и comments, см. миграцию 14c762fca798
+    news_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default=text("0"))
+    comments_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default=text("0"))
 
     news: Mapped[list["News"]] = relationship(
         back_populates="author",
@@ -1,80 +1,195 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
-from sqlalchemy.orm import Session
-from app.db.db import SessionLocal
-from app.models.comment import Comment
+from datetime import datetime
+from functools import partial
+from uuid import UUID
+from fastapi import APIRouter, Depends, HTTPException, Body, Header, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.db import get_db
+from app.db.comment_events import EVENT_ID_RE, comment_events, publish_comment_event
+from app.db.comment_stream import COMMENTS_WRITE_BEHIND, comment_status, enqueue_comment
+from app.db.errors import violated_constraint
+from app.db.pagination import decode_cursor, make_page
+from app.db.profiling import sql_budget
+from app.db.replicas import get_read_db
+from app.db.streaming import ndjson_response, wants_ndjson
+from app.models.comment import COMMENT_FIELDS, Comment, comment_to_dict
 from app.models.news import News
-from app.models.user import User
-from app.auth.deps import (
-    get_current_user,
-    resolve_news,
-    resolve_comment,
-    require_owner_comment,
-)
+from app.cache import trending
+from app.cache.codecs import JSON
+from app.cache.conditional import conditional_json
+from app.cache.keys import comments_version_key
+from app.cache.redis_cache import cache_bump_version, cache_peek, cache_set, cache_version
+from app.auth.deps import Principal, ensure_owner, get_current_user, get_stream_user
 
 router = APIRouter(prefix="/api", tags=["Comments"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+COMMENTS_CACHE_TTL = 300
 
-def comment_to_dict(c: Comment) -> dict:
-    return {
-        "id": c.id,
-        "text": c.text,
-        "published_at": c.published_at.isoformat(),
-        "news_id": c.news_id,
-        "author_id": c.author_id,
-    }
+# Новость и автор нового комментария проверяются внешними ключами, а не отдельными SELECT
+FK_NOT_FOUND = {
+    "fk_comments_news_id_news": "News not found",
+    "fk_comments_author_id_users": "User not found",
+}
 
 @router.get("/news/{news_id}/comments", dependencies=[Depends(get_current_user)])
-def list_comments_for_news(news_id: int, db: Session = Depends(get_db)):
-    if not db.get(News, news_id):
+@sql_budget(2)
+async def list_comments_for_news(
+    news_id: int,
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    after: str | None = Query(None),
+    stream: bool = Query(False),
+    fields: str | None = Query(None, description="comma-separated response fields, e.g. id,text,author_id"),
+    db: AsyncSession = Depends(get_db),
+):
+    names = COMMENT_FIELDS.parse(fields)
+    streaming = wants_ndjson(request, stream)
+    if not streaming:
+        version = await cache_version(comments_version_key(news_id))
+        # у каждого набора полей своя страница в кэше, версия новости сбрасывает их все разом
+        cache_key = f"comments:{news_id}:v{version}:{limit}:{after or ''}{COMMENT_FIELDS.cache_suffix(names)}"
+        cached = await cache_peek(cache_key)
+        if cached is not None:
+            return conditional_json(request, cached.json_bytes())
+
+    if not await db.get(News, news_id):
         raise HTTPException(404, "News not found")
-    comments = db.query(Comment).filter(Comment.news_id == news_id).order_by(Comment.published_at).all()
-    return [comment_to_dict(c) for c in comments]
+    stmt = (
+        select(Comment)
+        .options(COMMENT_FIELDS.load_only(names, Comment.published_at))
+        .where(Comment.news_id == news_id)
+        .order_by(Comment.published_at, Comment.id)
+    )
+    if after:
+        published_at, comment_id = decode_cursor(after, datetime, int)
+        # отдельное условие на published_at планировщик использует для отсечения секций (partition pruning),
+        # сравнение кортежей - нет
+        stmt = stmt.where(
+            Comment.published_at >= published_at,
+            tuple_(Comment.published_at, Comment.id) > tuple_(published_at, comment_id),
+        )
+    to_dict = partial(comment_to_dict, fields=names)
+    if streaming:
+        return ndjson_response(stmt, to_dict)
+    comments = (await db.scalars(stmt.limit(limit + 1))).all()
+    page = make_page(comments, limit, to_dict, lambda c: (c.published_at, c.id))
+    # Last-Modified у страницы нет: удаление комментария не меняет самое свежее updated_at окна,
+    # и If-Modified-Since отдал бы 304 со старым списком - страница проверяется только по ETag
+    await cache_set(cache_key, page, ttl=COMMENTS_CACHE_TTL)
+    # те же байты, что потом вернёт запись кэша, - ETag не зависит от того, был ли промах
+    return conditional_json(request, JSON.dumps(page))
+
+@router.get("/news/{news_id}/comments/events", dependencies=[Depends(get_stream_user)])
+@sql_budget(0)
+async def comment_events_for_news(
+    news_id: int,
+    last_event_id: str | None = Header(None),
+    after: str | None = Query(None, description="same as Last-Event-ID, for clients that cannot set headers"),
+):
+    # Server-Sent Events: comment.created / comment.updated / comment.deleted по мере изменений.
+    # Переподключение с Last-Event-ID дочитывает пропущенное из истории; событие reset означает,
+    # что пропущенное уже вне истории и список нужно загрузить заново.
+    resume_from = last_event_id or after
+    if resume_from is not None and not EVENT_ID_RE.match(resume_from):
+        raise HTTPException(400, "Invalid event id")
+    return StreamingResponse(
+        comment_events(news_id, resume_from),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @router.get("/comments/{comment_id}", dependencies=[Depends(get_current_user)])
-def get_comment(comment_id: int, db: Session = Depends(get_db)):
-    c = db.get(Comment, comment_id)
+@sql_budget(1)
+async def get_comment(
+    comment_id: int,
+    fields: str | None = Query(None, description="comma-separated response fields, e.g. id,text,author_id"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    names = COMMENT_FIELDS.parse(fields)
+    c = await db.get(Comment, comment_id, options=[COMMENT_FIELDS.load_only(names)])
     if not c:
         raise HTTPException(404, "Comment not found")
-    return comment_to_dict(c)
+    return comment_to_dict(c, names)
 
 @router.post("/news/{news_id}/comments/create", dependencies=[Depends(get_current_user)])
-def create_comment_for_news(
+@sql_budget(1)
+async def create_comment_for_news(
     news_id: int,
     text: str = Body(...),
     author_id: int = Body(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    if not db.get(News, news_id):
-        raise HTTPException(404, "News not found")
-    if not db.get(User, author_id):
-        raise HTTPException(404, "User not found")
+    if COMMENTS_WRITE_BEHIND:
+        # Запись в БД позже, пачкой: ответ 202, состояние - по ссылке из Location
+        accepted = await enqueue_comment(news_id, author_id, text)
+        return JSONResponse(
+            {**accepted, "status": "accepted"},
+            status_code=202,
+            headers={"Location": f"/api/comments/client/{accepted['client_id']}"},
+        )
     c = Comment(text=text, news_id=news_id, author_id=author_id)
     db.add(c)
-    db.commit()
-    db.refresh(c)
-    return comment_to_dict(c)
+    try:
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        detail = FK_NOT_FOUND.get(violated_constraint(e))
+        if detail is None:
+            raise
+        raise HTTPException(404, detail)
+    await cache_bump_version(comments_version_key(news_id))
+    await trending.record_comments([(news_id, c.published_at)])
+    body = comment_to_dict(c)
+    await publish_comment_event(news_id, "comment.created", body)
+    return body
+
+@router.get("/comments/client/{client_id}", dependencies=[Depends(get_current_user)])
+@sql_budget(1)
+async def get_comment_by_client_id(client_id: UUID, db: AsyncSession = Depends(get_db)):
+    # Состояние комментария, принятого с отложенной записью: 200 - записан, 202 - ещё в очереди,
+    # 404 - отклонён (причина как у обычного создания: новость или автор не найдены)
+    status, result = await comment_status(client_id, db)
+    if status == "stored":
+        return comment_to_dict(result)
+    if status == "rejected":
+        raise HTTPException(404, result)
+    return JSONResponse({"client_id": str(client_id), "status": "pending"}, status_code=202)
 
-@router.put("/comments/{comment_id}/update", dependencies=[Depends(require_owner_comment)])
-def update_comment(comment_id: int, text: str = Body(...), db: Session = Depends(get_db)):
-    c = db.get(Comment, comment_id)
+@router.put("/comments/{comment_id}/update")
+@sql_budget(2)
+async def update_comment(
+    comment_id: int,
+    text: str = Body(...),
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    c = await db.get(Comment, comment_id)
     if not c:
         raise HTTPException(404, "Comment not found")
+    ensure_owner(user, c.author_id)
     c.text = text
-    db.commit()
-    db.refresh(c)
-    return comment_to_dict(c)
+    await db.commit()
+    await cache_bump_version(comments_version_key(c.news_id))
+    body = comment_to_dict(c)
+    await publish_comment_event(c.news_id, "comment.updated", body)
+    return body
 
-@router.delete("/comments/{comment_id}/delete", status_code=204, dependencies=[Depends(require_owner_comment)])
-def delete_comment(comment_id: int, db: Session = Depends(get_db)):
-    c = db.get(Comment, comment_id)
+@router.delete("/comments/{comment_id}/delete", status_code=204)
+@sql_budget(2)
+async def delete_comment(
+    comment_id: int,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    c = await db.get(Comment, comment_id)
     if not c:
         raise HTTPException(404, "Comment not found")
-    db.delete(c)
-    db.commit()
+    ensure_owner(user, c.author_id)
+    await db.delete(c)
+    await db.commit()
+    await cache_bump_version(comments_version_key(c.news_id))
+    await trending.record_comments([(c.news_id, c.published_at)], sign=-1)
+    await publish_comment_event(c.news_id, "comment.deleted", {"id": c.id, "news_id": c.news_id})
     return None
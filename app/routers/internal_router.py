@@ -0,0 +1,43 @@
+import os
+import secrets
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from app.db.db import async_engine
+from app.db.pool import pool_status
+from app.db.replicas import replicas_status
+from app.cache.redis_cache import cache_stats_snapshot
+from app.db.comment_stream import stream_status
+from app.metrics import render
+
+# Служебные ручки для эксплуатации. Если задан INTERNAL_TOKEN, требуется заголовок X-Internal-Token.
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN")
+
+def require_internal(x_internal_token: str | None = Header(None)):
+    if INTERNAL_TOKEN and not secrets.compare_digest(x_internal_token or "", INTERNAL_TOKEN):
+        raise HTTPException(403, "Forbidden")
+
+router = APIRouter(
+    prefix="/internal",
+    tags=["Internal"],
+    include_in_schema=False,
+    dependencies=[Depends(require_internal)],
+)
+
+# /metrics - без префикса, по привычному для Prometheus адресу
+metrics_router = APIRouter(include_in_schema=False, dependencies=[Depends(require_internal)])
+
+@metrics_router.get("/metrics")
+async def metrics():
+    body, content_type = render()
+    return Response(body, media_type=content_type)
+
+@router.get("/pool")
+async def db_pool():
+    return {**pool_status(async_engine.pool), "replicas": replicas_status()}
+
+@router.get("/cache")
+async def cache_stats():
+    return cache_stats_snapshot()
+
+@router.get("/comment-stream")
+async def comment_stream_stats():
+    return await stream_status()
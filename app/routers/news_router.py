@@ -1,96 +1,265 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
-from sqlalchemy.orm import Session
-from app.db.db import SessionLocal
-from app.models.news import News
+from datetime import datetime
+from functools import partial
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request
+from sqlalchemy import func, literal_column, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, load_only
+from app.db.db import get_db
+from app.db.fields import FieldSet, cached_projection
+from app.db.pagination import decode_cursor, make_page
+from app.db.profiling import sql_budget
+from app.db.replicas import get_read_db
+from app.db.streaming import ndjson_response, wants_ndjson
+from app.models.news import News, SEARCH_CONFIG
 from app.models.user import User
-from app.auth.deps import get_current_user, require_verified_author, require_owner_news
-from app.cache.redis_cache import cache_get, cache_set, cache_delete
+from app.auth.deps import Principal, ensure_owner, get_current_user, require_verified_author
+from app.cache.conditional import conditional_json, item_modified
+from app.cache import trending
+from app.cache.redis_cache import (
+    cache_bump_version, cache_delete, cache_fill, cache_fill_many, cache_get_many, cache_get_or_load_entry,
+)
+from app.cache.keys import comments_version_key
 
 router = APIRouter(prefix="/api/news", tags=["News"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+NEWS_CACHE_TTL = 300  # 5 минут
 
-def news_to_dict(n: News) -> dict:
+NEWS_FIELDS = FieldSet(News, "id", "title", "content", "published_at", "updated_at", "author_id", "cover_url")
+
+def news_to_dict(n: News, fields: tuple[str, ...] = NEWS_FIELDS.names) -> dict:
+    return NEWS_FIELDS.dump(n, fields)
+
+@router.get("/list", dependencies=[Depends(get_current_user)])
+@sql_budget(1)
+async def list_news(
+    request: Request,
+    limit: int = Query(20, ge=1, le=100),
+    after: str | None = Query(None),
+    stream: bool = Query(False),
+    fields: str | None = Query(None, description="comma-separated response fields, e.g. id,title,cover_url"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    names = NEWS_FIELDS.parse(fields)
+    # читаются только запрошенные колонки и ключ курсора
+    stmt = (
+        select(News)
+        .options(NEWS_FIELDS.load_only(names, News.published_at))
+        .order_by(News.published_at.desc(), News.id.desc())
+    )
+    if after:
+        published_at, news_id = decode_cursor(after, datetime, int)
+        stmt = stmt.where(tuple_(News.published_at, News.id) < tuple_(published_at, news_id))
+    to_dict = partial(news_to_dict, fields=names)
+    if wants_ndjson(request, stream):
+        return ndjson_response(stmt, to_dict, bind=db.bind)
+    items = (await db.scalars(stmt.limit(limit + 1))).all()
+    return make_page(items, limit, to_dict, lambda n: (n.published_at, n.id))
+
+def feed_item_to_dict(n: News) -> dict:
     return {
         "id": n.id,
         "title": n.title,
-        "content": n.content,
         "published_at": n.published_at.isoformat(),
-        "author_id": n.author_id,
         "cover_url": n.cover_url,
+        "comments_count": n.comments_count,
+        "author": {
+            "id": n.author.id,
+            "name": n.author.name,
+            "avatar_url": n.author.avatar_url,
+        },
     }
 
-@router.get("/list", dependencies=[Depends(get_current_user)])
-def list_news(db: Session = Depends(get_db)):
-    items = db.query(News).order_by(News.published_at.desc(), News.id.desc()).all()
-    return [news_to_dict(n) for n in items]
+@router.get("/feed", dependencies=[Depends(get_current_user)])
+@sql_budget(1)
+async def news_feed(
+    limit: int = Query(20, ge=1, le=100),
+    after: str | None = Query(None),
+    db: AsyncSession = Depends(get_read_db),
+):
+    # Карточки ленты одним запросом: автор подтягивается JOIN-ом, число комментариев - готовый счётчик,
+    # тело новости (content) не читается вовсе
+    stmt = (
+        select(News)
+        .options(
+            load_only(News.id, News.title, News.published_at, News.cover_url, News.comments_count, News.author_id),
+            joinedload(News.author, innerjoin=True).load_only(User.id, User.name, User.avatar_url),
+        )
+        .order_by(News.published_at.desc(), News.id.desc())
+    )
+    if after:
+        published_at, news_id = decode_cursor(after, datetime, int)
+        stmt = stmt.where(tuple_(News.published_at, News.id) < tuple_(published_at, news_id))
+    items = (await db.scalars(stmt.limit(limit + 1))).all()
+    return make_page(items, limit, feed_item_to_dict, lambda n: (n.published_at, n.id))
+
+# Текст всех строковых значений content - для фрагментов с подсветкой
+NEWS_CONTENT_TEXT = literal_column(
+    "(SELECT string_agg(v #>> '{}', ' ') FROM jsonb_path_query(news.content, 'strict $.**') AS v "
+    "WHERE jsonb_typeof(v) = 'string')"
+)
+
+def search_row_to_dict(r) -> dict:
+    return {
+        "id": r.id,
+        "title": r.title,
+        "published_at": r.published_at.isoformat(),
+        "author_id": r.author_id,
+        "cover_url": r.cover_url,
+        "rank": r.rank,
+        "title_highlight": r.title_highlight,
+        "snippet": r.snippet,
+    }
+
+@router.get("/search", dependencies=[Depends(get_current_user)])
+@sql_budget(1)
+async def search_news(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    after: str | None = Query(None),
+    db: AsyncSession = Depends(get_read_db),
+):
+    query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    rank = func.ts_rank_cd(News.search_vector, query)
+    # Страница id выбирается по GIN-индексу и рангу; подсветка считается только для неё
+    page = select(News.id, rank.label("rank")).where(News.search_vector.op("@@")(query))
+    if after:
+        after_rank, news_id = decode_cursor(after, float, int)
+        page = page.where(tuple_(rank, News.id) < tuple_(after_rank, news_id))
+    page = page.order_by(rank.desc(), News.id.desc()).limit(limit + 1).subquery()
+
+    stmt = (
+        select(
+            News.id,
+            News.title,
+            News.published_at,
+            News.author_id,
+            News.cover_url,
+            page.c.rank,
+            func.ts_headline(SEARCH_CONFIG, News.title, query, "HighlightAll=true").label("title_highlight"),
+            func.ts_headline(
+                SEARCH_CONFIG, NEWS_CONTENT_TEXT, query, "MaxFragments=2, MinWords=10, MaxWords=30"
+            ).label("snippet"),
+        )
+        .join(page, page.c.id == News.id)
+        .order_by(page.c.rank.desc(), News.id.desc())
+    )
+    rows = (await db.execute(stmt)).all()
+    return make_page(rows, limit, search_row_to_dict, lambda r: (r.rank, r.id))
+
+@router.get("/trending", dependencies=[Depends(get_current_user)])
+@sql_budget(1)
+async def trending_news(limit: int = Query(20, ge=1, le=100), db: AsyncSession = Depends(get_db)):
+    # Порядок - из рейтинга в Redis, тела новостей - из кэша news:{id} одним MGET;
+    # в БД одним запросом идут только промахи кэша, и результат кладётся в кэш
+    ranked = await trending.top(limit)
+    entries = await cache_get_many([f"news:{news_id}" for news_id, _ in ranked])
+    bodies, missing = {}, []
+    for (news_id, _), entry in zip(ranked, entries):
+        if entry is None:
+            missing.append(news_id)
+        elif not entry.negative:
+            bodies[news_id] = entry.value()
+    if missing:
+        loaded = {n.id: news_to_dict(n) for n in await db.scalars(select(News).where(News.id.in_(missing)))}
+        await cache_fill_many(
+            {f"news:{news_id}": body for news_id, body in loaded.items()}, ttl=NEWS_CACHE_TTL,
+            last_modified=item_modified,
+        )
+        # удалённые новости убираем из рейтинга
+        await trending.forget(*(set(missing) - set(loaded)))
+        bodies.update(loaded)
+    return {
+        "items": [
+            {**bodies[news_id], "trending_score": round(score, 3)} for news_id, score in ranked if news_id in bodies
+        ],
+    }
 
 @router.get("/{news_id}", dependencies=[Depends(get_current_user)])
-def get_news(news_id: int, db: Session = Depends(get_db)):
-    cache_key = f"news:{news_id}"
-    cached = cache_get(cache_key)
-    if cached:
-        return cached
+@sql_budget(1)
+async def get_news(
+    news_id: int,
+    request: Request,
+    fields: str | None = Query(None, description="comma-separated response fields, e.g. id,title,cover_url"),
+    db: AsyncSession = Depends(get_db),
+):
+    async def load():
+        n = await db.get(News, news_id)
+        return news_to_dict(n) if n else None
 
-    n = db.get(News, news_id)
-    if not n:
+    names = NEWS_FIELDS.parse(fields)
+    if NEWS_FIELDS.is_full(names):
+        # отсутствующая новость тоже кэшируется (коротко), см. cache_get_or_load;
+        # из кэша приходит готовый JSON, который отдаётся без повторной сериализации (или 304 по ETag),
+        # и время изменения из заголовка записи
+        entry = await cache_get_or_load_entry(f"news:{news_id}", load, ttl=NEWS_CACHE_TTL, last_modified=item_modified)
+        result = None if entry.negative else (entry.json_bytes(), entry.modified)
+    else:
+        result = await cached_projection(
+            f"news:{news_id}", NEWS_FIELDS, names,
+            lambda: db.get(News, news_id, options=[NEWS_FIELDS.load_only(names)]),
+        )
+    if result is None:
         raise HTTPException(404, "News not found")
-    result = news_to_dict(n)
-
-    cache_set(cache_key, result, ttl=300)  # 5 минут
-    return result
+    trending.record_view(news_id)
+    return conditional_json(request, *result)
 
 @router.post("/create", dependencies=[Depends(require_verified_author)])
-def create_news(
+@sql_budget(2)
+async def create_news(
     title: str = Body(...),
     content: dict = Body(...),
     author_id: int = Body(...),
     cover_url: str | None = Body(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    author = db.get(User, author_id)
+    author = await db.get(User, author_id)
     if not author:
         raise HTTPException(404, "Author not found")
     if not author.is_verified_author:
         raise HTTPException(403, "Only verified authors can create news")
     n = News(title=title, content=content, author_id=author_id, cover_url=cover_url)
     db.add(n)
-    db.commit()
-    db.refresh(n)
-    cache_set(f"news:{n.id}", news_to_dict(n), ttl=300)
-    return news_to_dict(n)
+    await db.commit()
+    body = news_to_dict(n)
+    await cache_fill(f"news:{n.id}", body, ttl=NEWS_CACHE_TTL, modified=item_modified(body))
+    return body
 
 
-@router.put("/{news_id}/update", dependencies=[Depends(require_owner_news)])
-def update_news(
+@router.put("/{news_id}/update")
+@sql_budget(2)
+async def update_news(
     news_id: int,
     title: str = Body(...),
     content: dict = Body(...),
     cover_url: str | None = Body(None),
-    db: Session = Depends(get_db),
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
 ):
-    n = db.get(News, news_id)
+    n = await db.get(News, news_id)
     if not n:
         raise HTTPException(404, "News not found")
+    ensure_owner(user, n.author_id)
     n.title = title
     n.content = content
     n.cover_url = cover_url
-    db.commit()
-    db.refresh(n)
-    cache_delete(f"news:{news_id}")
+    await db.commit()
+    await cache_delete(f"news:{news_id}")
     return news_to_dict(n)
 
-@router.delete("/{news_id}/delete", status_code=204, dependencies=[Depends(require_owner_news)])
-def delete_news(news_id: int, db: Session = Depends(get_db)):
-    n = db.get(News, news_id)
+@router.delete("/{news_id}/delete", status_code=204)
+@sql_budget(2)
+async def delete_news(
+    news_id: int,
+    user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    n = await db.get(News, news_id)
     if not n:
         raise HTTPException(404, "News not found")
-    db.delete(n)
-    db.commit()
-    cache_delete(f"news:{news_id}")
+    ensure_owner(user, n.author_id)
+    await db.delete(n)
+    await db.commit()
+    await cache_delete(f"news:{news_id}")
+    await cache_bump_version(comments_version_key(news_id))
+    await trending.forget(news_id)
     return None
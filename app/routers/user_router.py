@@ -1,80 +1,128 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
-from sqlalchemy.orm import Session
-from app.db.db import SessionLocal
+from functools import partial
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request
+from sqlalchemy import select, union
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.db import get_db
+from app.db.fields import FieldSet, cached_projection
+from app.db.pagination import decode_cursor, make_page
+from app.db.profiling import sql_budget
+from app.db.replicas import get_read_db
+from app.db.streaming import ndjson_response, wants_ndjson
 from app.models.user import User
-from app.cache.redis_cache import cache_delete
+from app.models.news import News
+from app.models.comment import Comment
+from app.cache.conditional import conditional_json, item_modified
+from app.cache.redis_cache import cache_bump_version, cache_delete, cache_get_or_load_entry
+from app.cache.keys import comments_version_key, user_cache_key
 router = APIRouter(prefix="/api/users", tags=["Users"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Счётчики новостей и комментариев ведут триггеры в обход API, поэтому в кэше они могут отставать до USER_CACHE_TTL
+USER_CACHE_TTL = 60
 
-def user_to_dict(u: User) -> dict:
-    return {
-        "id": u.id,
-        "name": u.name,
-        "email": u.email,
-        "registered_at": u.registered_at.isoformat(),
-        "is_verified_author": u.is_verified_author,
-        "avatar_url": u.avatar_url,
-    }
+USER_FIELDS = FieldSet(
+    User, "id", "name", "email", "registered_at", "is_verified_author", "avatar_url", "updated_at",
+    "news_count", "comments_count",
+)
+
+def user_to_dict(u: User, fields: tuple[str, ...] = USER_FIELDS.names) -> dict:
+    return USER_FIELDS.dump(u, fields)
 
 @router.get("/list")
-def list_users(db: Session = Depends(get_db)):
-    users = db.query(User).order_by(User.id).all()
-    return [user_to_dict(u) for u in users]
+@sql_budget(1)
+async def list_users(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    after: str | None = Query(None),
+    stream: bool = Query(False),
+    fields: str | None = Query(None, description="comma-separated response fields, e.g. id,name,avatar_url"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    names = USER_FIELDS.parse(fields)
+    stmt = select(User).options(USER_FIELDS.load_only(names)).order_by(User.id)
+    if after:
+        (user_id,) = decode_cursor(after, int)
+        stmt = stmt.where(User.id > user_id)
+    to_dict = partial(user_to_dict, fields=names)
+    if wants_ndjson(request, stream):
+        return ndjson_response(stmt, to_dict, bind=db.bind)
+    users = (await db.scalars(stmt.limit(limit + 1))).all()
+    return make_page(users, limit, to_dict, lambda u: (u.id,))
 
 @router.get("/{user_id}")
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    u = db.get(User, user_id)
-    if not u:
+@sql_budget(1)
+async def get_user(
+    user_id: int,
+    request: Request,
+    fields: str | None = Query(None, description="comma-separated response fields, e.g. id,name,avatar_url"),
+    db: AsyncSession = Depends(get_db),
+):
+    async def load():
+        u = await db.get(User, user_id)
+        return user_to_dict(u) if u else None
+
+    names = USER_FIELDS.parse(fields)
+    if USER_FIELDS.is_full(names):
+        entry = await cache_get_or_load_entry(
+            user_cache_key(user_id), load, ttl=USER_CACHE_TTL, last_modified=item_modified,
+        )
+        result = None if entry.negative else (entry.json_bytes(), entry.modified)
+    else:
+        result = await cached_projection(
+            user_cache_key(user_id), USER_FIELDS, names,
+            lambda: db.get(User, user_id, options=[USER_FIELDS.load_only(names)]),
+        )
+    if result is None:
         raise HTTPException(404, "User not found")
-    return user_to_dict(u)
+    return conditional_json(request, *result)
 
 @router.post("/create")
-def create_user(
+@sql_budget(2)
+async def create_user(
     name: str = Body(...),
     email: str = Body(...),
     is_verified_author: bool = Body(False),
     avatar_url: str | None = Body(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    if db.query(User).filter(User.email == email).first():
+    if await db.scalar(select(User.id).where(User.email == email)):
         raise HTTPException(400, "Email already exists")
     u = User(name=name, email=email, is_verified_author=is_verified_author, avatar_url=avatar_url)
     db.add(u)
-    db.commit()
-    db.refresh(u)
+    await db.commit()
     return user_to_dict(u)
 
 @router.put("/{user_id}/update")
-def update_user(
+@sql_budget(2)
+async def update_user(
     user_id: int,
     name: str = Body(...),
     is_verified_author: bool = Body(...),
     avatar_url: str | None = Body(None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    u = db.get(User, user_id)
+    u = await db.get(User, user_id)
     if not u:
         raise HTTPException(404, "User not found")
     u.name = name
     u.is_verified_author = is_verified_author
     u.avatar_url = avatar_url
-    db.commit()
-    db.refresh(u)
-    cache_delete(f"user:{user_id}")
+    await db.commit()
+    await cache_delete(f"user:{user_id}", user_cache_key(user_id))
     return user_to_dict(u)
 
 @router.delete("/{user_id}/delete", status_code=204)
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    u = db.get(User, user_id)
+@sql_budget(3)
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    u = await db.get(User, user_id)
     if not u:
         raise HTTPException(404, "User not found")
-    db.delete(u)
-    db.commit()
-    cache_delete(f"user:{user_id}")
+    # каскад удалит комментарии пользователя и его новости - их ленты комментариев устареют
+    touched_news = (await db.scalars(union(
+        select(Comment.news_id).where(Comment.author_id == user_id),
+        select(News.id).where(News.author_id == user_id),
+    ))).all()
+    await db.delete(u)
+    await db.commit()
+    await cache_delete(f"user:{user_id}", user_cache_key(user_id))
+    await cache_bump_version(*(comments_version_key(news_id) for news_id in touched_news))
     return None
@@ -0,0 +1,10 @@
+"""Нагрузочные замеры API.
+
+    python -m bench.generate --users 10000 --news 50000 --comments 500000
+    python -m bench.run --output bench/results/baseline.json
+    python -m bench.run --compare bench/results/baseline.json
+
+generate заливает синтетические данные в базу из DATABASE_URL через COPY, run прогоняет все ручки
+в процессе (httpx + ASGI) с заданной конкурентностью и пишет задержки, число SQL-запросов и обращений
+к Redis по каждой ручке в json. Запускать только на отдельной базе: оба скрипта пишут в неё.
+"""
@@ -0,0 +1,211 @@
+"""Генератор синтетических данных для нагрузочных замеров.
+
+    python -m bench.generate --users 10000 --news 50000 --comments 500000
+    python -m bench.generate --users 1000 --news 5000 --comments 50000 --content-kb 8 --truncate
+
+Строки пишутся потоком через COPY прямо в рабочие таблицы с id после текущего максимума, так что
+повторный запуск дописывает данные. Триггеры счётчиков на время загрузки отключаются, счётчики
+пересчитываются одним проходом в конце. У всех пользователей пароль BENCH_PASSWORD.
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Iterator
+from app.auth.passwords import hash_password
+from app.db.bulk import _IterFile, _csv_field
+from app.db.db import engine
+from app.db.partitions import ensure_partitions
+
+BENCH_PASSWORD = "benchpass"
+BENCH_EMAIL_DOMAIN = "bench.example.com"
+
+WORDS = (
+    "новости город власти выборы экономика рынок цены рубль банк компания проект закон суд президент "
+    "правительство регион школа университет студенты наука исследование технологии интернет сеть данные "
+    "безопасность спорт матч команда чемпионат погода дождь снег транспорт метро дорога строительство дом "
+    "культура театр кино фестиваль музей выставка книга автор история война мир переговоры соглашение "
+    "энергетика нефть газ электричество климат экология лес река здоровье врачи больница лекарство "
+    "инвестиции бизнес стартап рост снижение прогноз отчёт интервью заявление эксперт мнение решение"
+).split()
+TAGS = ("политика", "экономика", "общество", "спорт", "культура", "наука", "технологии", "здоровье", "происшествия")
+
+# Пересчёт счётчиков после загрузки с отключёнными триггерами (как в миграции 14c762fca798)
+REBUILD_COUNTERS = (
+    """UPDATE news n SET comments_count = c.cnt
+       FROM (SELECT n.id, count(c.id) AS cnt FROM news n LEFT JOIN comments c ON c.news_id = n.id GROUP BY n.id) c
+       WHERE c.id = n.id AND n.comments_count <> c.cnt""",
+    """UPDATE users u SET news_count = n.cnt
+       FROM (SELECT u.id, count(n.id) AS cnt FROM users u LEFT JOIN news n ON n.author_id = u.id GROUP BY u.id) n
+       WHERE n.id = u.id AND u.news_count <> n.cnt""",
+    """UPDATE users u SET comments_count = c.cnt
+       FROM (SELECT u.id, count(c.id) AS cnt FROM users u LEFT JOIN comments c ON c.author_id = u.id GROUP BY u.id) c
+       WHERE c.id = u.id AND u.comments_count <> c.cnt""",
+)
+COUNTER_TRIGGERS = (("comments", "comments_counters"), ("news", "news_counters"))
+
+def _sentence(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choices(WORDS, k=words))
+    return text[0].upper() + text[1:] + "."
+
+def _content(rng: random.Random, size: int) -> dict:
+    # структура как у настоящей статьи: лид, абзацы, теги; размер - около size байт
+    blocks, total = [], 0
+    while total < size:
+        text = " ".join(_sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(2, 6)))
+        blocks.append({"type": "paragraph", "text": text})
+        total += len(text.encode())
+    return {"lead": _sentence(rng, 25), "blocks": blocks, "tags": rng.sample(TAGS, 3)}
+
+def _content_size(rng: random.Random, content_kb: float) -> int:
+    # логнормальное распределение: большинство статей около среднего, немного длинных
+    return min(int(rng.lognormvariate(math.log(content_kb * 1024), 0.6)), 64 * 1024)
+
+def _rows(rows: Iterator[tuple]) -> Iterator[str]:
+    batch = []
+    for row in rows:
+        batch.append(",".join(_csv_field(v) for v in row) + "\n")
+        if len(batch) >= 1000:
+            yield "".join(batch)
+            batch = []
+    yield "".join(batch)
+
+def _copy(cur, table: str, columns: tuple[str, ...], rows: Iterator[tuple]):
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        _IterFile(_rows(rows)),
+        size=1 << 16,
+    )
+
+def generate(users: int, news: int, comments: int, content_kb: float, days: int, seed: int, truncate: bool) -> dict:
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    start = now - timedelta(days=days)
+    span = (now - start).total_seconds()
+    password_hash = hash_password(BENCH_PASSWORD)
+    timings = {}
+
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        if truncate:
+            cur.execute("TRUNCATE comments, news, users RESTART IDENTITY CASCADE")
+        for table, trigger in COUNTER_TRIGGERS:
+            cur.execute(f"ALTER TABLE {table} DISABLE TRIGGER {trigger}")
+
+        def next_id(table: str) -> int:
+            cur.execute(f"SELECT coalesce(max(id), 0) + 1 FROM {table}")
+            return cur.fetchone()[0]
+
+        t = time.perf_counter()
+        first_user = next_id("users")
+        user_ids = range(first_user, first_user + users)
+        # каждый пятый - верифицированный автор, новости пишут только они
+        author_ids = [uid for uid in user_ids if uid % 5 == 0] or list(user_ids)
+        _copy(cur, "users", (
+            "id", "name", "email", "registered_at", "is_verified_author", "avatar_url", "password_hash", "is_admin",
+        ), (
+            (
+                uid,
+                f"Пользователь {uid}",
+                f"user{uid}@{BENCH_EMAIL_DOMAIN}",
+                start + timedelta(seconds=rng.random() * span),
+                uid % 5 == 0,
+                f"https://cdn.example.com/avatars/{uid}.png" if rng.random() < 0.7 else None,
+                password_hash,
+                False,
+            )
+            for uid in user_ids
+        ))
+        timings["users"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        first_news = next_id("news")
+        # новости по возрастанию времени: чем больше id, тем свежее
+        news_times = sorted(start + timedelta(seconds=rng.random() * span) for _ in range(news))
+        _copy(cur, "news", ("id", "title", "content", "published_at", "cover_url", "author_id"), (
+            (
+                first_news + i,
+                _sentence(rng, rng.randint(5, 12))[:255],
+                _content(rng, _content_size(rng, content_kb)),
+                published_at,
+                f"https://cdn.example.com/covers/{first_news + i}.jpg" if rng.random() < 0.8 else None,
+                rng.choice(author_ids),
+            )
+            for i, published_at in enumerate(news_times)
+        ))
+        timings["news"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        first_comment = next_id("comments")
+
+        def comment_rows():
+            for i in range(comments):
+                # комментарии сосредоточены на свежих новостях: степенное распределение от конца списка
+                n = news - 1 - int(news * rng.random() ** 3)
+                published_at = news_times[n] + timedelta(seconds=rng.random() * min(span, 7 * 86400))
+                yield (
+                    first_comment + i,
+                    _sentence(rng, rng.randint(3, 40)),
+                    min(published_at, now),
+                    first_news + n,
+                    rng.choice(user_ids),
+                )
+
+        if news:
+            # секции на весь диапазон дат, иначе строки осядут в секции по умолчанию
+            ensure_partitions(cur, start, now)
+            _copy(cur, "comments", ("id", "text", "published_at", "news_id", "author_id"), comment_rows())
+        timings["comments"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        for sql in REBUILD_COUNTERS:
+            cur.execute(sql)
+        for table, trigger in COUNTER_TRIGGERS:
+            cur.execute(f"ALTER TABLE {table} ENABLE TRIGGER {trigger}")
+        for table in ("users", "news", "comments"):
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), GREATEST((SELECT max(id) FROM {table}), 1))")
+        raw.commit()
+        timings["counters"] = time.perf_counter() - t
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+    # статистика планировщика после массовой загрузки
+    raw = engine.raw_connection()
+    try:
+        raw.set_session(autocommit=True)
+        raw.cursor().execute("ANALYZE users, news, comments")
+    finally:
+        raw.close()
+
+    return {
+        "users": users,
+        "news": news,
+        "comments": comments if news else 0,
+        "seconds": {name: round(value, 2) for name, value in timings.items()},
+    }
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m bench.generate", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--news", type=int, default=50_000)
+    parser.add_argument("--comments", type=int, default=500_000)
+    parser.add_argument("--content-kb", type=float, default=4, help="typical size of news content JSON")
+    parser.add_argument("--days", type=int, default=365, help="spread publication dates over this many days")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--truncate", action="store_true", help="delete ALL users, news and comments first")
+    args = parser.parse_args(argv)
+    if args.users < 1:
+        parser.error("--users must be positive")
+    result = generate(args.users, args.news, args.comments, args.content_kb, args.days, args.seed, args.truncate)
+    json.dump(result, sys.stdout)
+    print()
+
+if __name__ == "__main__":
+    main()
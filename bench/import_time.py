@@ -0,0 +1,64 @@
+"""Проверка холодного старта: импорт app.main и create_app() в свежем интерпретаторе.
+
+    python -m bench.import_time
+    python -m bench.import_time --budget-ms 1500 --runs 5 --top 15
+
+Время берётся лучшим из --runs запусков (без -X importtime, который сам замедляет импорт), разбивка по
+пакетам - из отдельного запуска с -X importtime. Код выхода 1, если лучшее время больше бюджета, - так
+проверку можно поставить в CI. Соединения с БД и Redis при этом не открываются: это делает lifespan.
+Бюджет по умолчанию (1500 мс) - лучшее время на 1 vCPU Intel Xeon, Python 3.11.7 (1070-1190 мс) с запасом.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import Counter
+
+STARTUP = (
+    "import time; start = time.perf_counter(); import app.main; app.main.create_app(); "
+    "print((time.perf_counter() - start) * 1000)"
+)
+
+def measure_ms() -> float:
+    out = subprocess.run([sys.executable, "-c", STARTUP], capture_output=True, text=True, check=True).stdout
+    return float(out.strip().splitlines()[-1])
+
+def breakdown() -> Counter:
+    # собственное время импорта модулей (self, в мкс), сложенное по пакетам верхнего уровня
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", STARTUP], capture_output=True, text=True, check=True,
+    ).stderr
+    by_package: Counter = Counter()
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line.removeprefix("import time:").split("|")
+        name = name.strip()
+        # пакеты приложения - с точностью до модуля второго уровня, остальные - по верхнему уровню
+        package = ".".join(name.split(".")[:2]) if name.startswith("app.") else name.split(".")[0]
+        by_package[package] += int(self_us)
+    return by_package
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m bench.import_time", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1500")))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="heaviest packages to print")
+    args = parser.parse_args(argv)
+
+    runs = [measure_ms() for _ in range(args.runs)]
+    best = min(runs)
+    report = {
+        "best_ms": round(best, 1),
+        "runs_ms": [round(ms, 1) for ms in runs],
+        "budget_ms": args.budget_ms,
+        "packages_ms": {name: round(us / 1000, 1) for name, us in breakdown().most_common(args.top)},
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if best > args.budget_ms:
+        print(f"cold start {best:.0f} ms exceeds budget {args.budget_ms:.0f} ms", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""Нагрузочный прогон всех ручек API в процессе.
+
+    python -m bench.run --requests 500 --concurrency 20 --output bench/results/baseline.json
+    python -m bench.run --only 'news.*' --compare bench/results/baseline.json --fail-on-regression 20
+
+Приложение вызывается через httpx.ASGITransport без сети, но с настоящими Postgres и Redis из
+DATABASE_URL/REDIS_URL. По каждой ручке считаются пропускная способность, p50/p95/p99, число SQL-запросов
+и обращений к Redis на запрос. Пишущие ручки меняют данные - запускать на базе из bench.generate.
+"""
+import argparse
+import asyncio
+import fnmatch
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+import httpx
+from redis.asyncio.connection import AbstractConnection
+from sqlalchemy import event, text
+from app.main import app
+from app.auth.jwt import jwt_encode, make_access_payload
+from app.auth.sessions import create_session
+from app.db.db import async_engine, engine
+from bench.generate import BENCH_EMAIL_DOMAIN, BENCH_PASSWORD, WORDS
+
+# Настройки, от которых зависят результаты - попадают в meta
+SETTINGS = (
+    "DB_POOL_SIZE", "DB_MAX_OVERFLOW", "DB_PGBOUNCER", "CACHE_L1_SIZE", "CACHE_CODEC", "CACHE_COMPRESSION",
+    "PASSWORD_HASH_WORKERS", "ARGON2_TIME_COST", "ARGON2_MEMORY_COST",
+)
+
+@dataclass
+class Tally:
+    sql: int = 0
+    redis: int = 0
+
+# Счётчики текущего сценария; запросы сценария выполняются в его контексте
+_tally: ContextVar[Tally | None] = ContextVar("bench_tally", default=None)
+
+def _count_sql(*args):
+    tally = _tally.get()
+    if tally is not None:
+        tally.sql += 1
+
+def instrument():
+    # SQL - события движка, Redis - каждая отправка команды (пайплайн уходит одной отправкой = один round trip)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", _count_sql)
+    send = AbstractConnection.send_packed_command
+
+    async def send_packed_command(self, command, check_health=True):
+        tally = _tally.get()
+        if tally is not None:
+            tally.redis += 1
+        return await send(self, command, check_health)
+
+    AbstractConnection.send_packed_command = send_packed_command
+
+@dataclass
+class Fixtures:
+    user_ids: list[int]
+    author_ids: list[int]
+    news_ids: list[int]
+    comment_ids: list[int]
+    login_emails: list[str]
+    token: str
+    run_id: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+    # id и токены, заготовленные для удаляющих сценариев и refresh/logout
+    prepared: dict[str, list] = field(default_factory=dict)
+
+    @property
+    def auth(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def pick(self, ids: list, i: int):
+        return ids[i % len(ids)]
+
+def load_fixtures(sample: int) -> Fixtures:
+    with engine.connect() as conn:
+        def ids(sql: str) -> list:
+            return list(conn.scalars(text(sql), {"n": sample}))
+
+        user_ids = ids("SELECT id FROM users ORDER BY random() LIMIT :n")
+        author_ids = ids("SELECT id FROM users WHERE is_verified_author ORDER BY random() LIMIT :n")
+        # свежие новости читают чаще - берём их
+        news_ids = ids("SELECT id FROM news ORDER BY published_at DESC LIMIT :n")
+        comment_ids = ids("SELECT id FROM comments ORDER BY id DESC LIMIT :n")
+        login_emails = list(conn.scalars(
+            text("SELECT email FROM users WHERE email LIKE :pattern AND password_hash IS NOT NULL LIMIT :n"),
+            {"pattern": f"%@{BENCH_EMAIL_DOMAIN}", "n": sample},
+        ))
+    if not (author_ids and news_ids and comment_ids):
+        raise SystemExit("database has no data to benchmark, run python -m bench.generate first")
+    # администратор-автор: проходит и require_verified_author, и проверки владения
+    token = jwt_encode(make_access_payload(author_ids[0], True, True), os.getenv("JWT_SECRET", "dev"))
+    return Fixtures(user_ids, author_ids, news_ids, comment_ids, login_emails, token)
+
+Call = Callable[[httpx.AsyncClient, Fixtures, int], Awaitable[httpx.Response]]
+Prepare = Callable[[httpx.AsyncClient, Fixtures, int], Awaitable[list]]
+
+@dataclass
+class Scenario:
+    name: str
+    call: Call
+    prepare: Prepare | None = None
+    needs_login: bool = False
+
+SCENARIOS: list[Scenario] = []
+
+def scenario(name: str, prepare: Prepare | None = None, needs_login: bool = False):
+    def decorator(call: Call) -> Call:
+        SCENARIOS.append(Scenario(name, call, prepare, needs_login))
+        return call
+    return decorator
+
+def _word(i: int) -> str:
+    return WORDS[i % len(WORDS)]
+
+# --- пользователи
+
+@scenario("users.list")
+async def users_list(client, fx, i):
+    return await client.get("/api/users/list", params={"limit": 50})
+
+@scenario("users.get")
+async def users_get(client, fx, i):
+    return await client.get(f"/api/users/{fx.pick(fx.user_ids, i)}")
+
+@scenario("users.create")
+async def users_create(client, fx, i):
+    return await client.post("/api/users/create", json={
+        "name": f"bench {i}", "email": f"create-{fx.run_id}-{i}@{BENCH_EMAIL_DOMAIN}",
+    })
+
+@scenario("users.update")
+async def users_update(client, fx, i):
+    # авторы остаются авторами - иначе поплывут сценарии создания новостей
+    user_id = fx.pick(fx.author_ids, i)
+    return await client.put(f"/api/users/{user_id}/update", json={
+        "name": f"Пользователь {user_id}", "is_verified_author": True,
+    })
+
+async def _prepare_users(client, fx, n):
+    created = []
+    for i in range(n):
+        r = await client.post("/api/users/create", json={
+            "name": "bench delete", "email": f"delete-{fx.run_id}-{i}@{BENCH_EMAIL_DOMAIN}",
+        })
+        created.append(r.json()["id"])
+    return created
+
+@scenario("users.delete", prepare=_prepare_users)
+async def users_delete(client, fx, i):
+    return await client.delete(f"/api/users/{fx.prepared['users.delete'][i]}/delete")
+
+# --- новости
+
+@scenario("news.list")
+async def news_list(client, fx, i):
+    return await client.get("/api/news/list", params={"limit": 20}, headers=fx.auth)
+
+@scenario("news.feed")
+async def news_feed(client, fx, i):
+    return await client.get("/api/news/feed", params={"limit": 20}, headers=fx.auth)
+
+@scenario("news.search")
+async def news_search(client, fx, i):
+    return await client.get("/api/news/search", params={"q": f"{_word(i)} {_word(i * 7 + 3)}"}, headers=fx.auth)
+
+@scenario("news.get")
+async def news_get(client, fx, i):
+    return await client.get(f"/api/news/{fx.pick(fx.news_ids, i)}", headers=fx.auth)
+
+async def _prepare_etags(client, fx, n):
+    etags = []
+    for news_id in fx.news_ids[:n]:
+        etags.append((news_id, (await client.get(f"/api/news/{news_id}", headers=fx.auth)).headers.get("etag")))
+    return etags
+
+@scenario("news.get_not_modified", prepare=_prepare_etags)
+async def news_get_not_modified(client, fx, i):
+    news_id, etag = fx.pick(fx.prepared["news.get_not_modified"], i)
+    return await client.get(f"/api/news/{news_id}", headers={**fx.auth, "If-None-Match": etag or ""})
+
+def _news_body(fx: Fixtures, i: int) -> dict:
+    return {
+        "title": f"Бенчмарк {_word(i)} {i}",
+        "content": {"lead": " ".join(_word(i + k) for k in range(30)), "blocks": [], "tags": ["bench"]},
+        "author_id": fx.author_ids[0],
+    }
+
+@scenario("news.create")
+async def news_create(client, fx, i):
+    return await client.post("/api/news/create", json=_news_body(fx, i), headers=fx.auth)
+
+@scenario("news.update")
+async def news_update(client, fx, i):
+    body = _news_body(fx, i)
+    del body["author_id"]
+    return await client.put(f"/api/news/{fx.pick(fx.news_ids, i)}/update", json=body, headers=fx.auth)
+
+async def _prepare_news(client, fx, n):
+    return [
+        (await client.post("/api/news/create", json=_news_body(fx, i), headers=fx.auth)).json()["id"]
+        for i in range(n)
+    ]
+
+@scenario("news.delete", prepare=_prepare_news)
+async def news_delete(client, fx, i):
+    return await client.delete(f"/api/news/{fx.prepared['news.delete'][i]}/delete", headers=fx.auth)
+
+# --- комментарии
+
+@scenario("comments.list")
+async def comments_list(client, fx, i):
+    return await client.get(f"/api/news/{fx.pick(fx.news_ids, i)}/comments", params={"limit": 50}, headers=fx.auth)
+
+@scenario("comments.get")
+async def comments_get(client, fx, i):
+    return await client.get(f"/api/comments/{fx.pick(fx.comment_ids, i)}", headers=fx.auth)
+
+@scenario("comments.create")
+async def comments_create(client, fx, i):
+    return await client.post(f"/api/news/{fx.pick(fx.news_ids, i)}/comments/create", json={
+        "text": f"Бенчмарк {_word(i)}", "author_id": fx.pick(fx.user_ids, i),
+    }, headers=fx.auth)
+
+@scenario("comments.update")
+async def comments_update(client, fx, i):
+    return await client.put(f"/api/comments/{fx.pick(fx.comment_ids, i)}/update", json={
+        "text": f"Исправлено: {_word(i)}",
+    }, headers=fx.auth)
+
+async def _prepare_comments(client, fx, n):
+    return [
+        (await comments_create(client, fx, i)).json()["id"]
+        for i in range(n)
+    ]
+
+@scenario("comments.delete", prepare=_prepare_comments)
+async def comments_delete(client, fx, i):
+    return await client.delete(f"/api/comments/{fx.prepared['comments.delete'][i]}/delete", headers=fx.auth)
+
+# --- авторизация
+
+@scenario("auth.register")
+async def auth_register(client, fx, i):
+    return await client.post("/api/auth/register", json={
+        "name": "bench", "email": f"register-{fx.run_id}-{i}@{BENCH_EMAIL_DOMAIN}", "password": BENCH_PASSWORD,
+    })
+
+@scenario("auth.login", needs_login=True)
+async def auth_login(client, fx, i):
+    return await client.post("/api/auth/login", json={
+        "email": fx.pick(fx.login_emails, i), "password": BENCH_PASSWORD,
+    })
+
+async def _prepare_sessions(client, fx, n):
+    return [await create_session(fx.pick(fx.user_ids, i), "bench") for i in range(n)]
+
+@scenario("auth.refresh", prepare=_prepare_sessions)
+async def auth_refresh(client, fx, i):
+    return await client.post("/api/auth/refresh", json={"refresh_token": fx.pick(fx.prepared["auth.refresh"], i)})
+
+@scenario("auth.logout", prepare=_prepare_sessions)
+async def auth_logout(client, fx, i):
+    return await client.post("/api/auth/logout", json={"refresh_token": fx.prepared["auth.logout"][i]})
+
+@scenario("auth.sessions")
+async def auth_sessions(client, fx, i):
+    return await client.get("/api/auth/sessions", headers=fx.auth)
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    return statistics.quantiles(sorted_values, n=100, method="inclusive")[q - 1]
+
+async def run_scenario(client: httpx.AsyncClient, fx: Fixtures, sc: Scenario, requests: int, concurrency: int, warmup: int) -> dict:
+    if sc.prepare is not None:
+        fx.prepared[sc.name] = await sc.prepare(client, fx, requests + warmup)
+    # прогрев (кэши, пул соединений) не учитывается; удаляющие сценарии берут из заготовки id после него
+    for i in range(warmup):
+        await sc.call(client, fx, requests + i)
+
+    tally = Tally()
+    _tally.set(tally)
+    latencies: list[float] = []
+    statuses: Counter = Counter()
+    indexes = iter(range(requests))
+
+    async def worker():
+        for i in indexes:
+            start = time.perf_counter()
+            response = await sc.call(client, fx, i)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(asyncio.create_task(worker()) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    _tally.set(None)
+
+    latencies.sort()
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "rps": round(requests / elapsed, 1),
+        "mean_ms": ms(statistics.fmean(latencies)),
+        "p50_ms": ms(_percentile(latencies, 50)),
+        "p95_ms": ms(_percentile(latencies, 95)),
+        "p99_ms": ms(_percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]),
+        "sql_per_request": round(tally.sql / requests, 2),
+        "redis_per_request": round(tally.redis / requests, 2),
+    }
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _data_volume() -> dict:
+    # оценка по статистике планировщика: count(*) на больших таблицах сам по себе долгий
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT relname, reltuples::bigint FROM pg_class WHERE relname IN ('users', 'news', 'comments')"
+        ))
+        return {name: count for name, count in rows}
+
+async def run(patterns: list[str], requests: int, concurrency: int, warmup: int, sample: int) -> dict:
+    instrument()
+    fx = load_fixtures(sample)
+    selected = [sc for sc in SCENARIOS if any(fnmatch.fnmatch(sc.name, p) for p in patterns)]
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers={"User-Agent": "bench"}) as client:
+        for sc in selected:
+            if sc.needs_login and not fx.login_emails:
+                results[sc.name] = {"skipped": "no users with the bench password, run python -m bench.generate"}
+                continue
+            print(f"{sc.name} ...", file=sys.stderr, flush=True)
+            results[sc.name] = await run_scenario(client, fx, sc, requests, concurrency, warmup)
+    await async_engine.dispose()
+
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "requests": requests,
+            "concurrency": concurrency,
+            "warmup": warmup,
+            "data": _data_volume(),
+            "settings": {name: os.environ[name] for name in SETTINGS if name in os.environ},
+        },
+        "endpoints": results,
+    }
+
+def compare(current: dict, baseline: dict, threshold: float | None) -> bool:
+    # печатает разницу с базовым прогоном; False - если p95 какой-то ручки вырос больше threshold процентов
+    ok = True
+    print(f"{'endpoint':28} {'p95 ms':>18} {'rps':>18} {'sql/req':>12} {'redis/req':>12}")
+    for name, now in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if "skipped" in now or not before or "skipped" in before:
+            continue
+        delta = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        regressed = threshold is not None and delta > threshold
+        ok = ok and not regressed
+        print(
+            f"{name:28} {before['p95_ms']:>7} -> {now['p95_ms']:<7} {before['rps']:>7} -> {now['rps']:<7} "
+            f"{before['sql_per_request']:>4} -> {now['sql_per_request']:<4} "
+            f"{before['redis_per_request']:>4} -> {now['redis_per_request']:<4}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return ok
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m bench.run", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per endpoint")
+    parser.add_argument("--sample", type=int, default=1000, help="how many existing ids to spread requests over")
+    parser.add_argument("--only", action="append", help="endpoint name pattern, e.g. 'news.*' (repeatable)")
+    parser.add_argument("--list", action="store_true", help="print endpoint names and exit")
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON from a previous run")
+    parser.add_argument("--fail-on-regression", type=float, metavar="PCT",
+                        help="exit with status 1 if any p95 grew by more than PCT percent against --compare")
+    args = parser.parse_args(argv)
+    if args.list:
+        print("\n".join(sc.name for sc in SCENARIOS))
+        return
+    if args.requests < 1 or args.concurrency < 1:
+        parser.error("--requests and --concurrency must be positive")
+
+    result = asyncio.run(run(args.only or ["*"], args.requests, args.concurrency, args.warmup, args.sample))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.fail_on_regression):
+            sys.exit(1)
+    elif not args.output:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
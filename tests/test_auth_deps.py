@@ -0,0 +1,28 @@
+from app.auth import deps
+from app.auth.deps import Principal, VerifiedTokenCache
+
+USER = Principal(id=1, is_admin=False, is_verified_author=True)
+
+def test_expired_token_is_dropped(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(deps.time, "time", lambda: now)
+    cache = VerifiedTokenCache(10)
+    cache.set("token", USER, expires_at=1060)
+    assert cache.get("token") == USER
+    now = 1060.0
+    assert cache.get("token") is None
+    assert "token" not in cache._data
+
+def test_least_recently_used_is_evicted():
+    cache = VerifiedTokenCache(2)
+    cache.set("a", USER, expires_at=2e9)
+    cache.set("b", USER, expires_at=2e9)
+    cache.get("a")
+    cache.set("c", USER, expires_at=2e9)
+    assert cache.get("b") is None
+    assert cache.get("a") == USER and cache.get("c") == USER
+
+def test_disabled_cache():
+    cache = VerifiedTokenCache(0)
+    cache.set("a", USER, expires_at=2e9)
+    assert cache.get("a") is None
@@ -0,0 +1,49 @@
+import json
+import pytest
+from app.cache import codecs
+from app.cache.codecs import CODECS, COMPRESSIONS, JSON, MAGIC, decode_entry, encode_entry
+
+VALUE = {"id": 1, "title": "Новость", "content": {"blocks": ["текст"] * 50}, "updated_at": "2026-10-01T12:00:00"}
+
+@pytest.mark.parametrize("codec_name", sorted(CODECS))
+@pytest.mark.parametrize("compression_name", sorted(COMPRESSIONS))
+def test_round_trip(monkeypatch, codec_name, compression_name):
+    monkeypatch.setattr(codecs, "codec", CODECS[codec_name][0])
+    monkeypatch.setattr(codecs, "compression", COMPRESSIONS[compression_name][0])
+    monkeypatch.setattr(codecs, "CACHE_COMPRESS_MIN_BYTES", 0)
+
+    data, written = encode_entry(VALUE, exp=100.5, dt=0.25, modified=1700000000.5)
+    entry = decode_entry(data)
+
+    assert data.startswith(MAGIC)
+    assert entry.value() == VALUE
+    assert json.loads(entry.json_bytes()) == VALUE
+    assert (entry.exp, entry.dt, entry.modified, entry.negative) == (100.5, 0.25, 1700000000.5, False)
+    assert entry.body == written.body
+
+def test_small_values_are_not_compressed(monkeypatch):
+    monkeypatch.setattr(codecs, "compression", COMPRESSIONS["zstd"][0])
+    data, _ = encode_entry({"id": 1})
+    assert data.endswith(JSON.dumps({"id": 1}))
+
+def test_without_modified():
+    entry = decode_entry(encode_entry(VALUE)[0])
+    assert entry.modified == 0.0
+    assert entry.value() == VALUE
+
+def test_negative_entry():
+    entry = decode_entry(encode_entry(None, exp=30.0)[0])
+    assert entry.negative
+    assert entry.value() is None
+    assert entry.json_bytes() is None
+
+def test_legacy_raw_json():
+    raw = json.dumps(VALUE).encode()
+    entry = decode_entry(raw)
+    assert entry.value() == VALUE
+    assert entry.json_bytes() == raw
+    assert (entry.exp, entry.modified, entry.negative) == (0.0, 0.0, False)
+
+def test_unknown_codec_is_a_miss():
+    data, _ = encode_entry(VALUE)
+    assert decode_entry(data[:1] + b"\x7f" + data[2:]) is None
@@ -0,0 +1,24 @@
+import pytest
+from fastapi import HTTPException
+from app.models.comment import COMMENT_FIELDS
+
+def test_parse_normalizes_order_and_adds_required():
+    names = COMMENT_FIELDS.parse("author_id, text")
+    assert names == ("id", "text", "author_id")
+    assert names == COMMENT_FIELDS.parse("text,author_id,id")
+    assert COMMENT_FIELDS.cache_suffix(names) == ":f=id,text,author_id"
+
+def test_parse_without_fields_is_full():
+    names = COMMENT_FIELDS.parse(None)
+    assert COMMENT_FIELDS.is_full(names)
+    assert COMMENT_FIELDS.cache_suffix(names) == ""
+
+def test_parse_rejects_unknown_fields():
+    with pytest.raises(HTTPException) as e:
+        COMMENT_FIELDS.parse("id,password,client_id")
+    assert e.value.status_code == 400
+    assert e.value.detail == "Unknown fields: client_id, password"
+
+def test_project():
+    body = {name: name for name in COMMENT_FIELDS.names}
+    assert COMMENT_FIELDS.project(body, ("id", "text")) == {"id": "id", "text": "text"}
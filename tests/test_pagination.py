@@ -0,0 +1,22 @@
+from datetime import datetime
+import pytest
+from fastapi import HTTPException
+from app.db.pagination import decode_cursor, encode_cursor, make_page
+
+def test_cursor_round_trip():
+    published_at = datetime(2026, 10, 1, 12, 30, 15, 123456)
+    cursor = encode_cursor(published_at, 42)
+    assert "=" not in cursor
+    assert decode_cursor(cursor, datetime, int) == (published_at, 42)
+
+@pytest.mark.parametrize("cursor", ["not base64!", encode_cursor(1), encode_cursor("x", 2), "e30", ""])
+def test_malformed_cursor(cursor):
+    with pytest.raises(HTTPException) as e:
+        decode_cursor(cursor, datetime, int)
+    assert e.value.status_code == 400
+
+def test_make_page():
+    page = make_page([1, 2, 3], 2, lambda r: {"id": r}, lambda r: (r,))
+    assert page["items"] == [{"id": 1}, {"id": 2}]
+    assert decode_cursor(page["next_cursor"], int) == (2,)
+    assert make_page([1, 2], 2, lambda r: {"id": r}, lambda r: (r,))["next_cursor"] is None